@@ -0,0 +1,206 @@
+# Third-party imports
+import numpy as np
+
+# Local imports
+from scraper import InvalidInputException, bulk_upsert, get_mongo_client, valid_dataset
+
+
+class ChartHistory:
+    """A dense NumPy view of a dataset of weekly Billboard charts for
+       computing chart statistics with vectorized operations.  Each
+       distinct song (its uri, or its query if it has no uri) gets an
+       integer id, and rankings is a (weeks x top_k) int32 array of song
+       ids, where rankings[week, rank - 1] is the song at rank that week.
+       Weeks with fewer than top_k items are padded with -1.
+
+    Args:
+        dataset (dict): A dict with the same form as that returned by
+            build_dataset (Ex. a ColumnarDataset's to_dict()).
+
+    Raises:
+        InvalidInputException: If dataset is given in an invalid format.
+    """
+    def __init__(self, dataset: dict):
+        # Dataset must be valid
+        if not valid_dataset(dataset):
+            raise InvalidInputException
+
+        self.dates = list(dataset)
+        top_k = max((len(dataset[date]) for date in self.dates), default=0)
+        self.rankings = np.full((len(self.dates), top_k), -1, dtype=np.int32)
+
+        # Lookup tables from song ids to songs and artist ids to artists
+        song_ids = {}
+        artist_ids = {}
+        self.songs = []
+        song_artists = []
+        for week, date in enumerate(self.dates):
+            for rank, item in enumerate(dataset[date]):
+                key = item['uri'] if item['uri'] is not None else item['query']
+                if key not in song_ids:
+                    song_ids[key] = len(song_ids)
+                    self.songs.append({'key': key,
+                                       'title': item['title'],
+                                       'artist': item['artist'],
+                                       'uri': item['uri']})
+                    song_artists.append(artist_ids.setdefault(item['artist'], len(artist_ids)))
+                self.rankings[week, rank] = song_ids[key]
+        self.artists = list(artist_ids)
+        self.song_artists = np.array(song_artists, dtype=np.int32)
+
+        # Flattened (week, rank, song) triples of every charted item
+        weeks, ranks = np.nonzero(self.rankings >= 0)
+        self._weeks = weeks
+        self._ranks = ranks + 1
+        self._songs = self.rankings[weeks, ranks]
+
+    def __len__(self) -> int:
+        return len(self.songs)
+
+    def weeks_on_chart(self) -> np.ndarray:
+        """Returns the number of weeks each song was on the chart,
+           indexed by song id."""
+        return np.bincount(self._songs, minlength=len(self.songs))
+
+    def peak_positions(self) -> np.ndarray:
+        """Returns the best (lowest) rank each song reached, indexed by
+           song id."""
+        peaks = np.full(len(self.songs), np.iinfo(np.int32).max, dtype=np.int32)
+        np.minimum.at(peaks, self._songs, self._ranks)
+        return peaks
+
+    def weeks_at_peak(self) -> np.ndarray:
+        """Returns the number of weeks each song spent at its peak
+           position, indexed by song id."""
+        at_peak = self._ranks == self.peak_positions()[self._songs]
+        return np.bincount(self._songs[at_peak], minlength=len(self.songs))
+
+    def debuts(self) -> tuple:
+        """Returns each song's first charting week and rank.
+
+        Returns:
+            tuple: A 2-arg tuple of arrays indexed by song id, where the
+                first arg holds the index into dates of each song's
+                debut week and the second arg its debut rank.
+        """
+        # Items are in week order, so a song's first item is its debut
+        _, first = np.unique(self._songs, return_index=True)
+        return self._weeks[first], self._ranks[first]
+
+    def number_one_runs(self) -> list:
+        """Finds every run of consecutive weeks a song spent at #1.
+
+        Returns:
+            list: (song id, index into dates of the run's first week,
+                number of weeks) tuples, longest run first (ties in date
+                order).
+        """
+        if self.rankings.size == 0:
+            return []
+        number_ones = self.rankings[:, 0]
+        # A run starts at the first week and wherever the #1 song changes
+        starts = np.flatnonzero(np.concatenate(([True], number_ones[1:] != number_ones[:-1])))
+        lengths = np.diff(np.append(starts, len(number_ones)))
+        songs = number_ones[starts]
+        charted = songs >= 0
+        starts, lengths, songs = starts[charted], lengths[charted], songs[charted]
+        order = np.lexsort((starts, -lengths))
+        return [(int(songs[i]), int(starts[i]), int(lengths[i])) for i in order]
+
+    def longest_number_one_runs(self) -> np.ndarray:
+        """Returns the longest run of consecutive weeks at #1 of each
+           song (0 if it never reached #1), indexed by song id."""
+        longest = np.zeros(len(self.songs), dtype=np.int32)
+        runs = self.number_one_runs()
+        if runs:
+            songs, _, lengths = np.array(runs, dtype=np.int64).T
+            np.maximum.at(longest, songs, lengths)
+        return longest
+
+    def artist_totals(self) -> dict:
+        """Totals each chart artist credit's songs.
+
+        Returns:
+            dict: A dict of arrays indexed by artist id (see artists)
+                with the keys 'songs' (number of songs), 'weeks' (total
+                weeks on chart of all songs), 'number_ones' (songs that
+                reached #1) and 'top_tens' (songs that reached the top
+                10).
+        """
+        peaks = self.peak_positions()
+        count = len(self.artists)
+        return {'songs': np.bincount(self.song_artists, minlength=count),
+                'weeks': np.bincount(self.song_artists, weights=self.weeks_on_chart(),
+                                     minlength=count).astype(np.int64),
+                'number_ones': np.bincount(self.song_artists[peaks == 1], minlength=count),
+                'top_tens': np.bincount(self.song_artists[peaks <= 10], minlength=count)}
+
+    def get_mongo_song_stats(self) -> list:
+        """Preps each song's statistics for MongoDB upload.
+
+        Returns:
+            list: A dict for each song of the form:
+                {'_id': uri (or query if it has no uri),
+                 'title': title,
+                 'artist': artist,
+                 'uri': uri,
+                 'weeks_on_chart': weeks,
+                 'peak_position': peak,
+                 'weeks_at_peak': weeks,
+                 'debut_date': date,
+                 'debut_rank': rank,
+                 'longest_number_one_run': weeks} .
+        """
+        columns = zip(self.weeks_on_chart().tolist(),
+                      self.peak_positions().tolist(),
+                      self.weeks_at_peak().tolist(),
+                      *(column.tolist() for column in self.debuts()),
+                      self.longest_number_one_runs().tolist())
+        return [{'_id': song['key'],
+                 'title': song['title'],
+                 'artist': song['artist'],
+                 'uri': song['uri'],
+                 'weeks_on_chart': weeks,
+                 'peak_position': peak,
+                 'weeks_at_peak': weeks_at_peak,
+                 'debut_date': self.dates[debut_week],
+                 'debut_rank': debut_rank,
+                 'longest_number_one_run': longest_run}
+                for song, (weeks, peak, weeks_at_peak, debut_week, debut_rank, longest_run)
+                in zip(self.songs, columns)]
+
+    def get_mongo_artist_stats(self) -> list:
+        """Preps each artist credit's totals for MongoDB upload.
+
+        Returns:
+            list: A dict for each artist credit of the form:
+                {'_id': artist, 'songs': songs, 'weeks': weeks,
+                 'number_ones': number_ones, 'top_tens': top_tens} .
+        """
+        totals = {key: values.tolist() for key, values in self.artist_totals().items()}
+        return [{'_id': artist, **{key: totals[key][i] for key in totals}}
+                for i, artist in enumerate(self.artists)]
+
+
+def save_chart_stats_to_mongo(history: ChartHistory, batch_size: int = 1000) -> dict:
+    """Uploads the song and artist statistics of a ChartHistory to the
+       'song_stats' and 'artist_stats' collections of the 'data'
+       database, next to 'billboard_rankings', replacing older
+       statistics.  Assumes the same MongoDB setup as update_mongo.
+
+    Args:
+        history (ChartHistory): The chart history of the full dataset.
+        batch_size (int): The number of documents sent in each bulk
+            write. Defaults to 1000.
+
+    Returns:
+        dict: The bulk_upsert counts for each collection, of the form:
+            {'song_stats': counts, 'artist_stats': counts} .
+    """
+    db = get_mongo_client().data
+    return {'song_stats': bulk_upsert(db.song_stats,
+                                      history.get_mongo_song_stats(),
+                                      batch_size=batch_size),
+            'artist_stats': bulk_upsert(db.artist_stats,
+                                        history.get_mongo_artist_stats(),
+                                        batch_size=batch_size)}
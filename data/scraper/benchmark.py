@@ -0,0 +1,410 @@
+# Python standard library imports
+import argparse
+import datetime
+import hashlib
+import json
+import os
+import platform
+import random
+import tempfile
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# Third-party imports
+import spotipy
+
+# Local imports
+import scraper
+
+
+BILLBOARD_URL = 'https://www.billboard.com'
+BASE62 = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz'
+FIRST_WEEK = datetime.date(1980, 1, 2)
+
+
+def _fake_id(key: str) -> str:
+    """Returns a stable 22-character base-62 Spotify-like id for key."""
+    number = int(hashlib.sha1(key.encode('utf-8')).hexdigest(), 16)
+    chars = []
+    for _ in range(22):
+        number, digit = divmod(number, 62)
+        chars.append(BASE62[digit])
+    return ''.join(chars)
+
+
+def synthetic_chart_page(date: str, size: int = 100) -> bytes:
+    """Builds a chart page with Billboard's markup for date.  Five songs
+       debut each week and every song charts for ten weeks, so songs
+       repeat across weeks the way they do on real charts.
+
+    Args:
+        date (str): An ISO-formatted (YYYY-MM-DD) date string.
+        size (int): The number of chart rows. Defaults to 100.
+
+    Returns:
+        bytes: The HTML page.
+    """
+    week = (datetime.date.fromisoformat(date) - FIRST_WEEK).days // 7
+    rows = []
+    for rank in range(size):
+        song = 5 * week + size - 1 - rank
+        featuring = f' Featuring Guest {song % 89}' if song % 7 == 0 else ''
+        rows.append('<li class="chart-list__element display--flex">'
+                    f'<span class="chart-element__rank__number">{rank + 1}</span>'
+                    '<span class="chart-element__information__song text--truncate color--primary">'
+                    f'Song {song} (From "Film {song % 13}")</span>'
+                    '<span class="chart-element__information__artist text--truncate color--secondary">'
+                    f'Artist {song % 997}{featuring}</span></li>')
+    return f'<html><body><ol class="chart-list__elements">{"".join(rows)}</ol></body></html>'.encode('utf-8')
+
+
+class FakeApiServer:
+    """A local stand-in for billboard.com chart pages and the Spotify
+       search, tracks, audio-features and artists endpoints.  Chart pages
+       are replayed from a ChartPageCache directory recorded by a real
+       run when available, and synthesized otherwise.
+
+    Args:
+        pages_directory (str): A ChartPageCache directory of recorded
+            chart pages. Defaults to None.
+        latency (float): Seconds added to every response. Defaults to 0.
+        error_rate (float): The fraction of requests answered with a 429
+            and a Retry-After header. Defaults to 0.
+        retry_after (int): The Retry-After, in seconds, sent with each
+            429. Defaults to 1.
+        miss_rate (float): The fraction of search queries that find no
+            tracks. Defaults to 0.01.
+        seed (int): Seeds the 429 injection. Defaults to 0.
+    """
+    def __init__(self,
+                 pages_directory: str = None,
+                 latency: float = 0,
+                 error_rate: float = 0,
+                 retry_after: int = 1,
+                 miss_rate: float = 0.01,
+                 seed: int = 0):
+        self.page_cache = scraper.ChartPageCache(pages_directory) if pages_directory else None
+        self.latency = latency
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.miss_rate = miss_rate
+        self.counts = {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler_class())
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self._server.server_port}'
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def reset_counts(self) -> dict:
+        """Returns the request counts per route and status, along with
+           the number of chart pages replayed and synthesized, and resets
+           them."""
+        with self._lock:
+            counts, self.counts = self.counts, {}
+        return counts
+
+    def _count(self, key: str) -> None:
+        with self._lock:
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+    def _should_fail(self) -> bool:
+        with self._lock:
+            return self._random.random() < self.error_rate
+
+    def respond(self, path: str, params: dict) -> tuple:
+        """Returns the (status, content type, body) of a request.  Chart
+           pages are counted as 'charts replayed' or 'charts synthesized'."""
+        if path.startswith('/charts/hot-100/'):
+            date = path.rsplit('/', 1)[-1]
+            page = self.page_cache.get(date) if self.page_cache else None
+            self._count('charts replayed' if page else 'charts synthesized')
+            return 200, 'text/html', page or synthetic_chart_page(date)
+
+        ids = params.get('ids', [''])[0].split(',')
+        if path == '/v1/search':
+            query = params['q'][0]
+            found = int(hashlib.md5(query.encode('utf-8')).hexdigest(), 16) % 10000 >= self.miss_rate * 10000
+            items = [self._track(_fake_id(query))] if found else []
+            body = {'tracks': {'items': items}}
+        elif path == '/v1/tracks':
+            body = {'tracks': [self._track(track_id) for track_id in ids]}
+        elif path == '/v1/audio-features':
+            body = {'audio_features': [{'id': track_id,
+                                        'uri': f'spotify:track:{track_id}',
+                                        'danceability': 0.5,
+                                        'energy': 0.5,
+                                        'tempo': 120.0}
+                                       for track_id in ids]}
+        elif path == '/v1/artists':
+            body = {'artists': [{'id': artist_id,
+                                 'uri': f'spotify:artist:{artist_id}',
+                                 'name': f'Artist {artist_id[:4]}',
+                                 'genres': ['pop', 'rock']}
+                                for artist_id in ids]}
+        else:
+            return 404, 'application/json', b'{}'
+        return 200, 'application/json', json.dumps(body).encode('utf-8')
+
+    def _track(self, track_id: str) -> dict:
+        artist_id = _fake_id(track_id[:3])
+        return {'id': track_id,
+                'uri': f'spotify:track:{track_id}',
+                'name': f'Track {track_id[:6]}',
+                'artists': [{'id': artist_id,
+                             'uri': f'spotify:artist:{artist_id}',
+                             'name': f'Artist {artist_id[:4]}'}],
+                'album': {'images': [{'url': f'https://i.scdn.co/image/{track_id}/{size}',
+                                      'height': size,
+                                      'width': size}
+                                     for size in (640, 300, 64)]}}
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                path = url.path.rstrip('/')
+                route = path.split('/')[2] if path.startswith('/v1/') else 'charts'
+                time.sleep(server.latency)
+                if server._should_fail():
+                    server._count(f'{route} 429')
+                    self.send_response(429)
+                    self.send_header('Retry-After', str(server.retry_after))
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                status, content_type, body = server.respond(path, parse_qs(url.query))
+                server._count(f'{route} {status}')
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+
+class LocalBillboardSession(scraper.ScheduledSession):
+    """A ScheduledSession that sends billboard.com requests to a
+       FakeApiServer instead."""
+    def __init__(self, scheduler: scraper.RequestScheduler, server_url: str):
+        super().__init__(scheduler)
+        self.server_url = server_url
+
+    def request(self, method, url, *args, **kwargs):
+        if url.startswith(BILLBOARD_URL):
+            url = self.server_url + url[len(BILLBOARD_URL):]
+        return super().request(method, url, *args, **kwargs)
+
+
+def create_local_spotify_client(scheduler: scraper.RequestScheduler,
+                                server_url: str) -> spotipy.Spotify:
+    """Creates a Spotify client that talks to a FakeApiServer."""
+    spotify_client = spotipy.Spotify(auth='benchmark',
+                                     requests_session=scraper.ScheduledSession(scheduler))
+    spotify_client.prefix = f'{server_url}/v1/'
+    return spotify_client
+
+
+def _measure(name: str, func, server: FakeApiServer, **details) -> tuple:
+    """Runs func and returns its result along with a report of its wall
+       time, peak traced memory, the requests it sent and the scraper's
+       stage metrics.  Tracing slows allocations down, so func is timed
+       untraced and then run again under tracemalloc for the peak."""
+    server.reset_counts()
+    scraper.METRICS.reset()
+    start = time.perf_counter()
+    result = func()
+    seconds = time.perf_counter() - start
+    request_counts = server.reset_counts()
+    metrics = scraper.METRICS.to_dict()
+
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+        server.reset_counts()
+        scraper.METRICS.reset()
+    report = {'name': name,
+              'seconds': round(seconds, 4),
+              'peak_memory_bytes': peak,
+              'requests': request_counts,
+              'metrics': metrics,
+              **details}
+    print(f'{name}: {seconds:.3f}s, peak {peak / 2 ** 20:.1f} MiB')
+    return result, report
+
+
+def run_benchmarks(weeks: int = 52,
+                   end_date: datetime.date = None,
+                   pages_directory: str = None,
+                   latency: float = 0,
+                   error_rate: float = 0,
+                   miss_rate: float = 0.01,
+                   max_workers: int = 4,
+                   rate: float = None,
+                   top_k: int = 50) -> dict:
+    """Times build_dataset, get_spotify_info, manual_add_uris and the
+       save paths against a FakeApiServer.
+
+    Args:
+        weeks (int): The number of chart weeks to build, ending at
+            end_date. Defaults to 52.
+        end_date (datetime.date): The last week built. Defaults to None,
+            which uses the last week recorded in pages_directory if
+            given, else today.
+        pages_directory (str): A ChartPageCache directory of recorded
+            chart pages to replay.  Weeks it doesn't hold are
+            synthesized; build_dataset's report counts both.
+            Defaults to None.
+        latency (float): Seconds added to every fake response. Defaults
+            to 0.
+        error_rate (float): The fraction of fake responses that are 429s.
+            Defaults to 0.
+        miss_rate (float): The fraction of search queries that find no
+            tracks. Defaults to 0.01.
+        max_workers (int): Passed to build_dataset. Defaults to 4.
+        rate (float): Requests per second allowed per host by the
+            scheduler. Defaults to None, which doesn't rate limit.
+        top_k (int): Passed to build_dataset. Defaults to 50.
+
+    Returns:
+        dict: A machine-readable report of the form:
+            {'config': {...}, 'environment': {...}, 'results': [...]} ,
+            with one result per benchmark.
+    """
+    if end_date is None:
+        recorded_dates = scraper.ChartPageCache(pages_directory).dates() if pages_directory else []
+        end_date = (datetime.date.fromisoformat(recorded_dates[-1]) if recorded_dates
+                    else datetime.date.today())
+    start_date = end_date - datetime.timedelta(weeks=weeks - 1)
+    config = {'weeks': weeks,
+              'start_date': str(start_date),
+              'end_date': str(end_date),
+              'pages_directory': pages_directory,
+              'latency': latency,
+              'error_rate': error_rate,
+              'miss_rate': miss_rate,
+              'max_workers': max_workers,
+              'rate': rate,
+              'top_k': top_k}
+    results = []
+
+    with FakeApiServer(pages_directory=pages_directory,
+                       latency=latency,
+                       error_rate=error_rate,
+                       miss_rate=miss_rate) as server, \
+         tempfile.TemporaryDirectory() as output_directory:
+        scheduler = scraper.RequestScheduler(default_rate=rate, max_concurrency=max(8, max_workers))
+        http_session = LocalBillboardSession(scheduler, server.url)
+        spotify_client = create_local_spotify_client(scheduler, server.url)
+
+        dataset, report = _measure('build_dataset',
+                                   lambda: scraper.build_dataset(start_date,
+                                                                 end_date,
+                                                                 spotify_client,
+                                                                 http_session,
+                                                                 top_k=top_k,
+                                                                 max_workers=max_workers),
+                                   server)
+        report['weeks_per_second'] = round(len(dataset) / report['seconds'], 2)
+        report['pages_replayed'] = report['requests'].get('charts replayed', 0)
+        report['pages_synthesized'] = report['requests'].get('charts synthesized', 0)
+        if pages_directory:
+            print(f'Replayed {report["pages_replayed"]} recorded chart pages, '
+                  f'synthesized {report["pages_synthesized"]}')
+        results.append(report)
+
+        uris = scraper.get_unique_uris(dataset)
+        spotify_info_dict, report = _measure('get_spotify_info',
+                                             lambda: scraper.get_spotify_info(uris,
+                                                                              artist_info=True,
+                                                                              audio_features=True,
+                                                                              spotify_client=spotify_client),
+                                             server,
+                                             uris=len(uris))
+        report['uris_per_second'] = round(len(uris) / report['seconds'], 2)
+        results.append(report)
+
+        # Fix every missed query plus the repo's own manual fixes
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                               '..', 'json-files', 'manual_uris_dict.json'), encoding='utf-8') as f:
+            uri_dict = json.load(f)
+        uri_dict.update({item['query']: f'spotify:track:{_fake_id(item["query"] + " fix")}'
+                         for date in dataset for item in dataset[date] if item['uri'] is None})
+        _, report = _measure('manual_add_uris',
+                             lambda: scraper.manual_add_uris(dataset, uri_dict),
+                             server,
+                             fixes=len(uri_dict))
+        results.append(report)
+
+        for name, save in (('save_dataset_as_json',
+                            lambda: scraper.save_dataset_as_json(dataset, output_directory)),
+                           ('save_dataset_as_json mongodb ndjson gzip',
+                            lambda: scraper.save_dataset_as_json(dataset,
+                                                                 output_directory,
+                                                                 ndjson=True,
+                                                                 compression='gzip')),
+                           ('save_spotify_info_as_json',
+                            lambda: scraper.save_spotify_info_as_json(spotify_info_dict,
+                                                                      output_directory))):
+            file_path, report = _measure(name, save, server)
+            report['file_bytes'] = os.path.getsize(file_path)
+            results.append(report)
+
+    return {'config': config,
+            'environment': {'python': platform.python_version(),
+                            'platform': platform.platform(),
+                            'timestamp': datetime.datetime.now().isoformat(timespec='seconds')},
+            'results': results}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks the scraper offline against a fake Billboard and Spotify.')
+    parser.add_argument('--weeks', type=int, default=52,
+                        help='number of weeks to build (about 2400 covers 1980 to today)')
+    parser.add_argument('--end-date', type=datetime.date.fromisoformat, default=None)
+    parser.add_argument('--pages', default=None, help='ChartPageCache directory of recorded chart pages')
+    parser.add_argument('--latency', type=float, default=0, help='seconds added to every fake response')
+    parser.add_argument('--error-rate', type=float, default=0, help='fraction of fake responses that are 429s')
+    parser.add_argument('--miss-rate', type=float, default=0.01)
+    parser.add_argument('--max-workers', type=int, default=4)
+    parser.add_argument('--rate', type=float, default=None, help='requests per second allowed per host')
+    parser.add_argument('--top-k', type=int, default=50)
+    parser.add_argument('--output', default=None, help='where to write the JSON report (default: stdout)')
+    args = parser.parse_args()
+
+    benchmark_report = run_benchmarks(weeks=args.weeks,
+                                      end_date=args.end_date,
+                                      pages_directory=args.pages,
+                                      latency=args.latency,
+                                      error_rate=args.error_rate,
+                                      miss_rate=args.miss_rate,
+                                      max_workers=args.max_workers,
+                                      rate=args.rate,
+                                      top_k=args.top_k)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(benchmark_report, f, indent=4)
+    else:
+        print(json.dumps(benchmark_report, indent=4))
@@ -0,0 +1,130 @@
+# Python standard library imports
+import collections.abc
+import json
+import os
+
+# Third-party imports
+import numpy as np
+
+# Local imports
+from scraper import InvalidInputException, valid_dataset
+
+
+FIELDS = ('title', 'artist', 'query', 'uri')
+
+
+def save_dataset_columnar(dataset: dict, path: str) -> None:
+    """Saves a dataset of weekly Billboard charts in a columnar format.
+       Titles, artists, queries and uris are dictionary-encoded into
+       integer ids, each distinct (title, artist, query, uri) row is
+       stored once in entries.npy, and each week is a row of entry ids
+       in the dense (weeks x top_k) array rankings.npy.  Weeks with
+       fewer than top_k items are padded with -1.
+
+    Args:
+        dataset (dict): A dict with the same form as that returned by
+            build_dataset.
+        path (str): A path string (or path-like object) of the directory
+            the files are written to.  It is created if it doesn't exist.
+
+    Raises:
+        InvalidInputException: If dataset is given in an invalid
+            format.
+    """
+    # Dataset must be valid
+    if not valid_dataset(dataset):
+        raise InvalidInputException
+
+    # Dictionary-encode each field; None uris are encoded as -1
+    strings = {field: {} for field in FIELDS}
+    entry_ids = {}
+    dates = list(dataset)
+    top_k = max((len(dataset[date]) for date in dates), default=0)
+    rankings = np.full((len(dates), top_k), -1, dtype=np.int32)
+    for week, date in enumerate(dates):
+        for rank, item in enumerate(dataset[date]):
+            entry = tuple(-1 if item[field] is None
+                          else strings[field].setdefault(item[field], len(strings[field]))
+                          for field in FIELDS)
+            rankings[week, rank] = entry_ids.setdefault(entry, len(entry_ids))
+    entries = np.array(list(entry_ids), dtype=np.int32).reshape(-1, len(FIELDS))
+
+    os.makedirs(path, exist_ok=True)
+    np.save(os.path.join(path, 'rankings.npy'), rankings)
+    np.save(os.path.join(path, 'entries.npy'), entries)
+    with open(os.path.join(path, 'dates.json'), 'w', encoding='utf-8') as f:
+        json.dump(dates, f)
+    with open(os.path.join(path, 'strings.json'), 'w', encoding='utf-8') as f:
+        json.dump({field: list(strings[field]) for field in FIELDS}, f, ensure_ascii=False)
+
+
+def load_dataset_columnar(path: str) -> 'ColumnarDataset':
+    """Loads a dataset saved by save_dataset_columnar.  The integer
+       arrays are memory-mapped rather than read.
+
+    Args:
+        path (str): A path string (or path-like object) of the directory
+            the dataset was saved to.
+
+    Returns:
+        ColumnarDataset: A read-only mapping with the same form as the
+            dict returned by build_dataset.
+    """
+    return ColumnarDataset(path)
+
+
+class ColumnarDataset(collections.abc.Mapping):
+    """A read-only, memory-mapped view of a dataset saved by
+       save_dataset_columnar.  Keys are ISO dates (YYYY-MM-DD) and values
+       are rankings with the same form as build_dataset's.  Only the
+       weeks that are accessed are decoded into dicts.  Use to_dict() (or
+       dict()) before passing it to functions that modify datasets.
+
+    Args:
+        path (str): A path string (or path-like object) of the directory
+            the dataset was saved to.
+    """
+    def __init__(self, path: str):
+        self.rankings = np.load(os.path.join(path, 'rankings.npy'), mmap_mode='r')
+        self.entries = np.load(os.path.join(path, 'entries.npy'), mmap_mode='r')
+        with open(os.path.join(path, 'dates.json'), 'r', encoding='utf-8') as f:
+            self.dates = json.load(f)
+        with open(os.path.join(path, 'strings.json'), 'r', encoding='utf-8') as f:
+            self.strings = json.load(f)
+        self._weeks = {date: week for week, date in enumerate(self.dates)}
+        self._decoded = {}
+
+    def __getitem__(self, date: str) -> list:
+        if date not in self._decoded:
+            self._decoded[date] = self._decode_week(self._weeks[date])
+        return self._decoded[date]
+
+    def __iter__(self):
+        return iter(self.dates)
+
+    def __len__(self) -> int:
+        return len(self.dates)
+
+    def __contains__(self, date) -> bool:
+        return date in self._weeks
+
+    def _decode_week(self, week: int) -> list:
+        entry_ids = self.rankings[week]
+        entry_ids = entry_ids[entry_ids >= 0]
+        return [{field: None if string_id < 0 else self.strings[field][string_id]
+                 for field, string_id in zip(FIELDS, entry.tolist())}
+                for entry in self.entries[entry_ids]]
+
+    @property
+    def uris(self) -> set:
+        """The set of all unique uris in the dataset."""
+        return set(self.strings['uri'])
+
+    def to_dict(self) -> dict:
+        """Decodes every week into a dict with the same form as that
+           returned by build_dataset.
+
+        Returns:
+            dict: The decoded dataset.
+        """
+        return {date: [dict(item) for item in self[date]] for date in self.dates}
@@ -1,47 +1,565 @@
 # Python standard library imports
+import asyncio
+import collections.abc
+import contextlib
 import datetime
+import email.utils
+import functools
 import glob
+import gzip
+import hashlib
+import io
+import itertools
 import json
 import os
 import pickle
 import re
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from urllib.parse import urlparse
 import requests
 from requests.adapters import HTTPAdapter
 from urllib3.util import Retry
 
 # Third-party imports
-from lxml import html
+from lxml import etree
 import spotipy
 from spotipy.oauth2 import SpotifyClientCredentials
-from pymongo import MongoClient
+from pymongo import MongoClient, ReplaceOne, UpdateOne
 
 
 PARENTH = r'\([^)]*\)'
 QUOTES = r'\"[^)]*\"'
+PARENTH_PATTERN = re.compile(PARENTH)
+QUOTES_PATTERN = re.compile(QUOTES)
+
+# Chart page markup, keyed by the version of Billboard's site it matches.
+# Each chart row is a row_tag element whose class list contains row_class;
+# title, artist and rank are XPaths relative to the row.
+CHART_SELECTORS = {
+    '2020': {'row_tag': 'li',
+             'row_class': 'chart-list__element',
+             'title': 'descendant::span[@class="chart-element__information__song text--truncate color--primary"]/text()',
+             'artist': 'descendant::span[@class="chart-element__information__artist text--truncate color--secondary"]/text()',
+             'rank': 'descendant::span[@class="chart-element__rank__number"]/text()'},
+}
+LATEST_CHART_SELECTORS = '2020'
+
+# File name suffix of each compression supported by the JSON writers
+JSON_COMPRESSION_SUFFIXES = {None: '', 'gzip': '.gz', 'zstd': '.zst'}
+
+# Requests per second allowed to each host, across every session of a run
+DEFAULT_RATES = {'www.billboard.com': 2, 'api.spotify.com': 10}
+
+# Retries server errors with backoff; 429s are left to RequestScheduler
+RETRY_STRATEGY = Retry(
+    total=5,
+    status_forcelist=[500, 502, 503, 504],
+    allowed_methods=["HEAD", "GET", "OPTIONS"],
+    backoff_factor=2
+)
+
+# Shared by every Mongo write in the process; see get_mongo_client
+_mongo_client = None
+
+
+class ScraperMetrics:
+    """Thread-safe counters and timers for the scraper's stages, each
+       optionally labeled (Ex. by status code or collection).  Exported
+       as JSON or in the Prometheus text format.
+    """
+    def __init__(self):
+        self._counters = collections.defaultdict(float)
+        self._timers = {}
+        self._lock = threading.Lock()
+
+    def increment(self, name: str, value: float = 1, **labels) -> None:
+        """Adds value to the counter name with labels."""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] += value
+
+    def observe(self, name: str, seconds: float, **labels) -> None:
+        """Records one timing of seconds for the timer name with labels."""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            timer = self._timers.setdefault(key, {'count': 0, 'sum': 0.0, 'max': 0.0})
+            timer['count'] += 1
+            timer['sum'] += seconds
+            timer['max'] = max(timer['max'], seconds)
+
+    @contextlib.contextmanager
+    def timer(self, name: str, **labels):
+        """Times the body of a with block into the timer name."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def reset(self) -> None:
+        """Clears every counter and timer."""
+        with self._lock:
+            self._counters.clear()
+            self._timers.clear()
+
+    def to_dict(self) -> dict:
+        """Returns the metrics as a dict of the form:
+           {'counters': [{'name': name, 'labels': labels, 'value': value}, ...],
+            'timers': [{'name': name, 'labels': labels, 'count': count,
+                        'sum': sum, 'max': max}, ...]} ."""
+        with self._lock:
+            return {'counters': [{'name': name, 'labels': dict(labels), 'value': value}
+                                 for (name, labels), value in sorted(self._counters.items())],
+                    'timers': [{'name': name, 'labels': dict(labels), **timer}
+                               for (name, labels), timer in sorted(self._timers.items())]}
+
+    def merge(self, metrics: dict) -> None:
+        """Adds the metrics returned by another registry's to_dict (Ex. one
+           from a worker process) to these."""
+        with self._lock:
+            for entry in metrics['counters']:
+                key = (entry['name'], tuple(sorted(entry['labels'].items())))
+                self._counters[key] += entry['value']
+            for entry in metrics['timers']:
+                key = (entry['name'], tuple(sorted(entry['labels'].items())))
+                timer = self._timers.setdefault(key, {'count': 0, 'sum': 0.0, 'max': 0.0})
+                timer['count'] += entry['count']
+                timer['sum'] += entry['sum']
+                timer['max'] = max(timer['max'], entry['max'])
+
+    def to_json(self, indent: int = None) -> str:
+        """Returns the metrics of to_dict as a JSON string."""
+        return json.dumps(self.to_dict(), indent=indent)
+
+    def to_prometheus(self) -> str:
+        """Returns the metrics in the Prometheus text exposition format.
+           Counters are exported as counters and timers as summaries."""
+        def format_labels(labels):
+            if not labels:
+                return ''
+            return '{' + ','.join(f'{key}="{value}"' for key, value in labels.items()) + '}'
+
+        metrics = self.to_dict()
+        lines = []
+        for kind, entries in (('counter', metrics['counters']), ('summary', metrics['timers'])):
+            for name in sorted({entry['name'] for entry in entries}):
+                lines.append(f'# TYPE scraper_{name} {kind}')
+                for entry in entries:
+                    if entry['name'] != name:
+                        continue
+                    labels = format_labels(entry['labels'])
+                    if kind == 'counter':
+                        lines.append(f'scraper_{name}{labels} {entry["value"]}')
+                    else:
+                        lines.append(f'scraper_{name}_count{labels} {entry["count"]}')
+                        lines.append(f'scraper_{name}_sum{labels} {entry["sum"]}')
+        return '\n'.join(lines) + '\n'
+
+
+# Collects the timings and counts of every stage of the scraper
+METRICS = ScraperMetrics()
+
+
+class TokenBucket:
+    """A thread-safe token bucket.  Tokens refill at rate per second up to
+       capacity, and each request takes one.
+
+    Args:
+        rate (float): Tokens added per second.  If None, acquire never
+            waits (except while paused).
+        capacity (float): The maximum number of stored tokens, i.e. the
+            largest allowed burst. Defaults to None, which allows a
+            burst of max(1, rate).
+    """
+    def __init__(self, rate: float = None, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1, rate or 1)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """Blocks until a token is available and takes it."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                elif self.rate is None:
+                    return
+                else:
+                    self._tokens = min(self.capacity,
+                                       self._tokens + (now - self._updated) * self.rate)
+                    self._updated = now
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds: float) -> None:
+        """Hands out no tokens for the next seconds (Ex. a Retry-After)."""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = 0
+
+
+class RequestScheduler:
+    """Coordinates requests to several hosts (Ex. Billboard and Spotify)
+       across threads.  Each host gets its own token bucket and its own
+       concurrency limit, which is halved on every 429 response and
+       grows by about one per limit's worth of successes.  429 responses
+       pause the host for their Retry-After (or an exponential backoff if
+       it is missing) and are then retried.
+
+    Args:
+        rates (dict): Requests per second allowed for each host
+            (Ex. {'www.billboard.com': 2}). Defaults to None.
+        default_rate (float): Requests per second allowed for hosts not
+            in rates.  If None, they are not rate limited. Defaults to
+            None.
+        max_concurrency (int): The largest number of requests in flight
+            to one host. Defaults to 8.
+        max_retries (int): The number of times a 429 response is retried
+            before it is returned to the caller. Defaults to 5.
+        max_backoff (float): The longest wait, in seconds, after a 429
+            response. Defaults to 120.
+    """
+    def __init__(self,
+                 rates: dict = None,
+                 default_rate: float = None,
+                 max_concurrency: int = 8,
+                 max_retries: int = 5,
+                 max_backoff: float = 120):
+        self.rates = rates or {}
+        self.default_rate = default_rate
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.max_backoff = max_backoff
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def _host(self, host: str) -> dict:
+        with self._lock:
+            if host not in self._hosts:
+                self._hosts[host] = {'bucket': TokenBucket(self.rates.get(host, self.default_rate)),
+                                     'limit': float(self.max_concurrency),
+                                     'in_flight': 0,
+                                     'condition': threading.Condition()}
+            return self._hosts[host]
+
+    def concurrency_limit(self, host: str) -> int:
+        """Returns the current concurrency limit of host."""
+        return int(self._host(host)['limit'])
+
+    def send(self, url: str, send_request):
+        """Sends a request through the scheduler.
+
+        Args:
+            url (str): The url of the request, used to find its host.
+            send_request (callable): Sends the request and returns its
+                requests.Response.
+
+        Returns:
+            requests.Response: The first non-429 response, or the last
+                429 response once max_retries is exhausted.
+        """
+        host = self._host(urlparse(url).netloc)
+        for attempt in range(self.max_retries + 1):
+            with host['condition']:
+                host['condition'].wait_for(lambda: host['in_flight'] < int(host['limit']))
+                host['in_flight'] += 1
+            try:
+                host['bucket'].acquire()
+                response = send_request()
+            finally:
+                with host['condition']:
+                    host['in_flight'] -= 1
+                    host['condition'].notify_all()
+
+            with host['condition']:
+                if response.status_code != 429:
+                    host['limit'] = min(self.max_concurrency, host['limit'] + 1 / host['limit'])
+                    host['condition'].notify_all()
+                    return response
+                host['limit'] = max(1.0, host['limit'] / 2)
+            METRICS.increment('http_429_retries_total', host=urlparse(url).netloc)
+            host['bucket'].pause(self._retry_after(response, attempt))
+
+        return response
+
+    def _retry_after(self, response, attempt: int) -> float:
+        # Retry-After is either a number of seconds or an HTTP date
+        retry_after = response.headers.get('Retry-After')
+        try:
+            seconds = float(retry_after)
+        except (TypeError, ValueError):
+            try:
+                retry_date = email.utils.parsedate_to_datetime(retry_after)
+                seconds = (retry_date - datetime.datetime.now(datetime.timezone.utc)).total_seconds()
+            except (TypeError, ValueError):
+                seconds = 2 ** attempt
+        return min(self.max_backoff, max(0, seconds))
 
 
-def create_http_session(retry_strategy: Retry = None) -> requests.Session:
+class ScheduledSession(requests.Session):
+    """A requests.Session whose requests all go through a
+       RequestScheduler.  Safe to share between threads, and can be
+       handed to spotipy.Spotify as its requests_session.
+
+    Args:
+        scheduler (RequestScheduler): The scheduler shared by every
+            session that should be throttled together.
+    """
+    def __init__(self, scheduler: RequestScheduler):
+        super().__init__()
+        self.scheduler = scheduler
+
+    def request(self, method, url, *args, **kwargs):
+        send_request = functools.partial(super().request, method, url, *args, **kwargs)
+        return self.scheduler.send(url, send_request)
+
+
+def create_http_session(retry_strategy: Retry = None,
+                        max_requests_per_second: float = None,
+                        scheduler: RequestScheduler = None) -> requests.Session:
     """Creates an HTTP client session for web scraping.
 
     Args:
         retry_strategy (Retry): Retry strategy in case session is rate limited
             (429 error)
+        max_requests_per_second (float): The maximum number of requests
+            sent to any single host per second.  Ignored if scheduler is
+            given.  If None, requests are not throttled. Defaults to None.
+        scheduler (RequestScheduler): The scheduler the session's requests
+            go through.  429 responses are then retried by the scheduler,
+            so leave 429 out of retry_strategy. Defaults to None.
 
     Returns:
         requests.Session: The HTTP session equipped with retry_strategy
 
     """
+    if scheduler is None:
+        scheduler = RequestScheduler(default_rate=max_requests_per_second)
     adapter = HTTPAdapter(max_retries=retry_strategy)
-    session = requests.Session()
+    session = ScheduledSession(scheduler)
     session.mount("https://", adapter)
     session.mount ("http://", adapter)
     return session
 
 
+def create_spotify_client(scheduler: RequestScheduler = None,
+                          max_requests_per_second: float = None) -> spotipy.Spotify:
+    """Creates a Spotify client using the client credentials flow.
+       Credentials are read from the SPOTIPY_CLIENT_ID and
+       SPOTIPY_CLIENT_SECRET environment variables.
+
+    Args:
+        scheduler (RequestScheduler): The scheduler the client's requests
+            go through.  If None (and max_requests_per_second is None),
+            spotipy's own session and retries are used. Defaults to None.
+        max_requests_per_second (float): The maximum number of requests
+            sent to Spotify per second, through a scheduler of the
+            client's own.  Ignored if scheduler is given. Defaults to
+            None.
+
+    Returns:
+        spotipy.Spotify: The Spotify client.
+    """
+    if scheduler is None and max_requests_per_second is not None:
+        scheduler = RequestScheduler(default_rate=max_requests_per_second)
+    if scheduler is None:
+        return spotipy.Spotify(client_credentials_manager=SpotifyClientCredentials())
+    return spotipy.Spotify(client_credentials_manager=SpotifyClientCredentials(),
+                           requests_session=ScheduledSession(scheduler))
+
+
+class ChartPageCache:
+    """A compressed, content-addressed on-disk cache of Billboard chart
+       pages.  Pages are gzipped under pages/<sha256>.html.gz and each
+       date's entry under dates/<date>.json points at its page along with
+       the ETag and Last-Modified headers it was served with.  Charts
+       older than revalidate_after never change, so they are served
+       straight from disk; newer ones are revalidated with a conditional
+       GET.
+
+    Args:
+        directory (str): A path string (or path-like object) of the cache
+            directory.  It is created if it doesn't exist.
+        revalidate_after (datetime.timedelta): How old a chart must be
+            before its cached page is trusted without asking Billboard.
+            Defaults to 2 weeks.
+    """
+    def __init__(self,
+                 directory: str,
+                 revalidate_after: datetime.timedelta = datetime.timedelta(weeks=2)):
+        self.directory = directory
+        self.revalidate_after = revalidate_after
+        os.makedirs(os.path.join(directory, 'pages'), exist_ok=True)
+        os.makedirs(os.path.join(directory, 'dates'), exist_ok=True)
+
+    def _entry_path(self, date: str) -> str:
+        return os.path.join(self.directory, 'dates', f'{date}.json')
+
+    def _page_path(self, digest: str) -> str:
+        return os.path.join(self.directory, 'pages', f'{digest}.html.gz')
+
+    def entry(self, date: str) -> dict:
+        """Returns the cache entry of date, or None if it isn't cached."""
+        try:
+            with open(self._entry_path(date), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def get(self, date: str) -> bytes:
+        """Returns the cached page content of date, or None if it isn't
+           cached."""
+        entry = self.entry(date)
+        if entry is None:
+            return None
+        with gzip.open(self._page_path(entry['sha256']), 'rb') as f:
+            return f.read()
+
+    def put(self,
+            date: str,
+            content: bytes,
+            etag: str = None,
+            last_modified: str = None) -> None:
+        """Caches the page content of date along with its validators."""
+        digest = hashlib.sha256(content).hexdigest()
+        page_path = self._page_path(digest)
+        if not os.path.exists(page_path):
+            tmp_path = f'{page_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            with gzip.open(tmp_path, 'wb') as f:
+                f.write(content)
+            os.replace(tmp_path, page_path)
+        entry_path = self._entry_path(date)
+        tmp_path = f'{entry_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'sha256': digest,
+                       'etag': etag,
+                       'last_modified': last_modified}, f)
+        os.replace(tmp_path, entry_path)
+
+    def dates(self) -> list:
+        """Returns the ISO-formatted (YYYY-MM-DD) dates of every cached
+           page, in order."""
+        return sorted(file_name[:-len('.json')]
+                      for file_name in os.listdir(os.path.join(self.directory, 'dates'))
+                      if file_name.endswith('.json'))
+
+    def is_settled(self, date: str) -> bool:
+        """Returns True if the chart of date is too old to change."""
+        return datetime.date.fromisoformat(date) < datetime.date.today() - self.revalidate_after
+
+    def conditional_headers(self, date: str) -> dict:
+        """Returns the If-None-Match/If-Modified-Since headers that
+           revalidate the cached page of date."""
+        entry = self.entry(date) or {}
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+
+class ChartPageExtractor:
+    """Extracts chart rows from Billboard chart pages with XPaths compiled
+       once up front.  Pages are parsed incrementally, and parsing stops
+       as soon as the last needed row is complete.
+
+    Args:
+        selectors (dict): Selectors with the same form as the values of
+            CHART_SELECTORS. Defaults to None, which uses
+            CHART_SELECTORS[LATEST_CHART_SELECTORS].
+        chunk_size (int): The number of bytes fed to the parser at a
+            time. Defaults to 65536.
+    """
+    def __init__(self, selectors: dict = None, chunk_size: int = 65536):
+        selectors = selectors or CHART_SELECTORS[LATEST_CHART_SELECTORS]
+        self.selectors = selectors
+        self.row_tag = selectors['row_tag']
+        self.chunk_size = chunk_size
+        self.row_class = selectors['row_class']
+        self._title = etree.XPath(selectors['title'], smart_strings=False)
+        self._artist = etree.XPath(selectors['artist'], smart_strings=False)
+        self._rank = etree.XPath(selectors['rank'], smart_strings=False)
+
+    def __getstate__(self) -> dict:
+        # Compiled XPaths can't be pickled, so rebuild them from the selectors
+        return {'selectors': self.selectors, 'chunk_size': self.chunk_size}
+
+    def __setstate__(self, state: dict) -> None:
+        self.__init__(**state)
+
+    def extract(self,
+                content: bytes,
+                lower_bound: int = 0,
+                upper_bound: int = 100) -> tuple:
+        """Extracts the rows in [lower_bound, upper_bound) of a chart page.
+
+        Args:
+            content (bytes): The raw HTML content of a chart page.
+            lower_bound (int): The lower bound of the slice of the chart.
+                Defaults to 0.
+            upper_bound (int): The upper bound of the slice of the chart.
+                Defaults to 100.
+
+        Returns:
+            tuple: A 3-arg tuple of the title strings, the artist name
+                strings and the rank ints (None if missing) of the rows,
+                in ranking order.
+        """
+        parser = etree.HTMLPullParser(events=('end',), tag=self.row_tag)
+        rows = []
+        if not content:
+            return [], [], []
+        for start in range(0, len(content), self.chunk_size):
+            parser.feed(content[start:start + self.chunk_size])
+            self._read_rows(parser, rows)
+            if len(rows) >= upper_bound:
+                break
+        else:
+            parser.close()
+            self._read_rows(parser, rows)
+
+        rows = rows[lower_bound:upper_bound]
+        if not rows:
+            return [], [], []
+        titles, artists, ranks = zip(*rows)
+        return list(titles), list(artists), list(ranks)
+
+    def _read_rows(self, parser, rows: list) -> None:
+        for _, element in parser.read_events():
+            if self.row_class not in element.get('class', '').split():
+                continue
+            title = self._title(element)
+            artist = self._artist(element)
+            rank = self._rank(element)
+            rows.append((title[0] if title else '',
+                         artist[0] if artist else '',
+                         int(rank[0]) if rank and rank[0].strip().isdigit() else None))
+            # Rows are only read once, so free their subtrees as we go
+            element.clear()
+
+
+# Shared by every _parse_chart_page call that isn't given an extractor
+CHART_PAGE_EXTRACTOR = ChartPageExtractor()
+
+
 def _get_track_info(session: requests.Session,
                     date: str = None,
                     lower_bound: int = 0,
-                    upper_bound: int = 50) -> tuple:
+                    upper_bound: int = 50,
+                    page_cache: ChartPageCache = None,
+                    extractor: ChartPageExtractor = None) -> tuple:
     """Gets raw track and artist names for the given date from Billboard.
 
     Args:
@@ -52,6 +570,10 @@ def _get_track_info(session: requests.Session,
             Defaults to 0.
         upper_bound (int): The upper bound of the slice of the Billboard Hot 100.
             Defaults to 50.
+        page_cache (ChartPageCache): A cache of chart pages checked before
+            downloading. Defaults to None.
+        extractor (ChartPageExtractor): The extractor matching the page's
+            markup. Defaults to None, which uses CHART_PAGE_EXTRACTOR.
 
     Returns:
         tuple: A 2-arg tuple where the first arg is a list of the track title
@@ -68,28 +590,142 @@ def _get_track_info(session: requests.Session,
         print('Interval must be in [0, 100]...')
         raise InvalidInputException
 
+    page = _fetch_chart_page(session, date, page_cache=page_cache, extractor=extractor)
+    return _parse_chart_page(page, lower_bound, upper_bound, extractor=extractor)
+
+
+def _fetch_chart_page(session: requests.Session,
+                      date: str = None,
+                      page_cache: ChartPageCache = None,
+                      extractor: ChartPageExtractor = None) -> bytes:
+    """Downloads the Billboard Hot 100 page for the given date.
+
+    Args:
+        session (requests.Session): The HTTP session used to send GET requests
+            to Billboard.
+        date (str): An ISO-formatted (YYYY-MM-DD) date string. Defaults to None.
+        page_cache (ChartPageCache): A cache of chart pages.  Settled charts
+            are served from it without any request, recent ones are
+            revalidated with a conditional GET, and downloaded pages with
+            chart rows are added to it. Defaults to None.
+        extractor (ChartPageExtractor): The extractor that checks
+            downloaded pages for chart rows before they are cached.
+            Defaults to None, which uses CHART_PAGE_EXTRACTOR.
+
+    Returns:
+        bytes: The raw HTML content of the chart page.
+    """
+    # Serve settled charts from disk and revalidate recent ones
+    cached = page_cache.get(date) if page_cache is not None else None
+    headers = {}
+    if cached is not None:
+        if page_cache.is_settled(date):
+            METRICS.increment('billboard_page_cache_hits_total')
+            return cached
+        headers = page_cache.conditional_headers(date)
+
+    # 429s are retried after their Retry-After by a ScheduledSession
     chart_url = 'https://www.billboard.com/charts/hot-100/'
-    page = session.get(chart_url + date)
-
-    '''
-    Uncomment code below to attempt to get Retry-After header (gives site's rate limiting policy).
-    Didn't work when I tried it, however.
-    '''
-#     if page.status_code == 429:
-#         print(page)
-#         time.sleep(int(response.headers["Retry-After"]))
-    
-    # Make tree from page DOM
-    tree = html.fromstring(page.content)
-    titles_text = '//span[@class="chart-element__information__song text--truncate color--primary"]/text()'
-    artists_text = '//span[@class="chart-element__information__artist text--truncate color--secondary"]/text()'
-    
-    # Scrape top k of Hot 100 via xpaths
-    titles = tree.xpath(titles_text)[lower_bound:upper_bound]
-    artists = tree.xpath(artists_text)[lower_bound:upper_bound]
+    with METRICS.timer('billboard_fetch_seconds'):
+        page = session.get(chart_url + date, headers=headers)
+    METRICS.increment('billboard_responses_total', status=page.status_code)
+    METRICS.increment('billboard_bytes_total', len(page.content))
+    retries = getattr(getattr(page, 'raw', None), 'retries', None)
+    if retries is not None and retries.history:
+        METRICS.increment('billboard_adapter_retries_total', len(retries.history))
+    if cached is not None and page.status_code == 304:
+        return cached
+    # Don't cache error or placeholder pages served with a 200
+    extractor = extractor or CHART_PAGE_EXTRACTOR
+    if (page_cache is not None and
+        page.status_code == 200 and
+        extractor.extract(page.content, 0, 1)[0]):
+        page_cache.put(date,
+                       page.content,
+                       etag=page.headers.get('ETag'),
+                       last_modified=page.headers.get('Last-Modified'))
+    return page.content
+
+
+def _parse_chart_page(content: bytes,
+                      lower_bound: int = 0,
+                      upper_bound: int = 50,
+                      extractor: ChartPageExtractor = None) -> tuple:
+    """Parses raw track and artist names out of a Billboard chart page.
+
+    Args:
+        content (bytes): The raw HTML content of a chart page.
+        lower_bound (int): The lower bound of the slice of the Billboard Hot 100.
+            Defaults to 0.
+        upper_bound (int): The upper bound of the slice of the Billboard Hot 100.
+            Defaults to 50.
+        extractor (ChartPageExtractor): The extractor matching the page's
+            markup. Defaults to None, which uses CHART_PAGE_EXTRACTOR.
+
+    Returns:
+        tuple: The same 2-arg tuple returned by _get_track_info.
+    """
+    extractor = extractor or CHART_PAGE_EXTRACTOR
+    with METRICS.timer('parse_seconds'):
+        titles, artists, _ = extractor.extract(content, lower_bound, upper_bound)
     return titles, artists
 
 
+def _iter_track_info(session: requests.Session,
+                     dates: list,
+                     upper_bound: int = 50,
+                     max_workers: int = 1,
+                     page_cache: ChartPageCache = None,
+                     extractor: ChartPageExtractor = None):
+    """Yields raw track and artist names for each date from Billboard.
+
+    Args:
+        session (requests.Session): The HTTP session used to send GET requests
+            to Billboard.
+        dates (list): A list of ISO-formatted (YYYY-MM-DD) date strings.
+        upper_bound (int): The upper bound of the slice of the Billboard Hot 100.
+            Defaults to 50.
+        max_workers (int): The maximum number of pages downloaded at once.
+            Defaults to 1, which downloads one page at a time.
+        page_cache (ChartPageCache): A cache of chart pages. Defaults to
+            None.
+        extractor (ChartPageExtractor): The extractor matching the chart
+            pages' markup. Defaults to None, which uses
+            CHART_PAGE_EXTRACTOR.
+
+    Yields:
+        tuple: The same 2-arg tuple returned by _get_track_info for each
+            date.  Results are yielded in the same order as dates, no
+            matter which page finishes downloading first.
+    """
+    get_track_info = functools.partial(_get_track_info,
+                                       session,
+                                       upper_bound=upper_bound,
+                                       page_cache=page_cache,
+                                       extractor=extractor)
+    if max_workers <= 1:
+        for date in dates:
+            yield get_track_info(date=date)
+        return
+
+    # Keep a bounded window of pages in flight so memory stays flat
+    dates = iter(dates)
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    pending = collections.deque(executor.submit(get_track_info, date=date)
+                                for date in itertools.islice(dates, 2 * max_workers))
+    try:
+        while pending:
+            titles_artists = pending.popleft().result()
+            date = next(dates, None)
+            if date is not None:
+                pending.append(executor.submit(get_track_info, date=date))
+            yield titles_artists
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=False)
+
+
 def _clean_title_name(name: str) -> str:
     """Processes track title name to increase Spotify search success rate.
 
@@ -104,8 +740,8 @@ def _clean_title_name(name: str) -> str:
                .split('/', maxsplit=1)[0]
     
     # Remove parentheticals and quoted names
-    name = re.sub(PARENTH, '', name)
-    name = re.sub(QUOTES, '', name)
+    name = PARENTH_PATTERN.sub('', name)
+    name = QUOTES_PATTERN.sub('', name)
     
     # ~99% success rate currently; add more steps here if you want
     
@@ -134,14 +770,1027 @@ def _clean_artist_name(name: str) -> str:
                .split(' Introducing ', maxsplit=1)[0]
         
     # Remove parentheticals and quoted names
-    name = re.sub(PARENTH, '', name)
-    name = re.sub(QUOTES, '', name)
+    name = PARENTH_PATTERN.sub('', name)
+    name = QUOTES_PATTERN.sub('', name)
     
     # ~99% success rate currently; add more steps here if you want
 
     return name
 
 
+class NameNormalizer:
+    """Memoized, batch version of _clean_title_name and _clean_artist_name.
+       Each distinct raw name is cleaned once and kept in a bounded LRU
+       cache, so a chart's long-running songs aren't recleaned every week.
+       The cleaned names are exactly those of the underlying functions.
+
+    Args:
+        maxsize (int): The maximum number of raw names cached for each of
+            titles and artists. Defaults to 65536.
+    """
+    def __init__(self, maxsize: int = 65536):
+        self.clean_title = functools.lru_cache(maxsize=maxsize)(_clean_title_name)
+        self.clean_artist = functools.lru_cache(maxsize=maxsize)(_clean_artist_name)
+
+    def clean(self, titles: list, artists: list) -> tuple:
+        """Cleans a batch of raw titles and artist names (Ex. one week's
+           chart, or every week's concatenated).
+
+        Args:
+            titles (list): A list of raw track title strings.
+            artists (list): A list of raw track artist name strings.
+
+        Returns:
+            tuple: A 2-arg tuple of the lists of cleaned titles and cleaned
+                artist names, in the same order.
+        """
+        hits, misses = self._totals()
+        clean_titles = [self.clean_title(name) for name in titles]
+        clean_artists = [self.clean_artist(name) for name in artists]
+        new_hits, new_misses = self._totals()
+        METRICS.increment('name_normalizer_lookups_total', new_hits - hits, result='hit')
+        METRICS.increment('name_normalizer_lookups_total', new_misses - misses, result='miss')
+        return clean_titles, clean_artists
+
+    def _totals(self) -> tuple:
+        title_info = self.clean_title.cache_info()
+        artist_info = self.clean_artist.cache_info()
+        return title_info.hits + artist_info.hits, title_info.misses + artist_info.misses
+
+    @property
+    def hit_rate(self) -> float:
+        """The fraction of names served from the cache so far."""
+        hits, misses = self._totals()
+        return hits / (hits + misses) if hits + misses else 0.0
+
+    def clear(self) -> None:
+        """Empties both caches and resets their statistics."""
+        self.clean_title.cache_clear()
+        self.clean_artist.cache_clear()
+
+
+# Shared by build_dataset and build_dataset_async
+NAME_NORMALIZER = NameNormalizer()
+
+
+class QueryCache:
+    """An on-disk cache mapping Spotify query strings to track uris, shared
+       across weeks and runs.  Both hits and known misses (uri = None) are
+       recorded with the time they were last searched.  Misses can be given
+       an expiry, after which the query counts as uncached and is searched
+       again.  Supports `query in cache`, `cache[query]` and
+       `cache[query] = uri`.
+
+    Args:
+        path (str): A path string (or path-like object) of the JSON file
+            backing the cache.  Loaded if it exists.  If None, the cache
+            is kept in memory only. Defaults to None.
+        negative_ttl (datetime.timedelta): How long a known miss is
+            trusted before it is searched again.  If None, misses never
+            expire. Defaults to None.
+    """
+    def __init__(self,
+                 path: str = None,
+                 negative_ttl: datetime.timedelta = None):
+        self.path = path
+        self.negative_ttl = negative_ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                self._entries = {query: tuple(entry) for query, entry in json.load(f).items()}
+
+    def __contains__(self, query: str) -> bool:
+        entry = self._get_entry(query)
+        if entry is None:
+            return False
+        uri, timestamp = entry
+        if uri is None and self.negative_ttl is not None:
+            searched = datetime.datetime.fromisoformat(timestamp)
+            return datetime.datetime.now() - searched < self.negative_ttl
+        return True
+
+    def __getitem__(self, query: str) -> str:
+        if query not in self:
+            raise KeyError(query)
+        return self._get_entry(query)[0]
+
+    def __setitem__(self, query: str, uri: str) -> None:
+        self._set_entry(query, (uri, datetime.datetime.now().isoformat(timespec='seconds')))
+
+    def _get_entry(self, query: str) -> tuple:
+        return self._entries.get(query)
+
+    def _set_entry(self, query: str, entry: tuple) -> None:
+        with self._lock:
+            self._entries[query] = entry
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __getstate__(self) -> dict:
+        # Locks can't be pickled, so worker processes get a fresh one
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def merge(self, other: 'QueryCache') -> None:
+        """Adds the entries of another cache (Ex. one filled by a worker
+           process), keeping the most recently searched entry of each
+           query.
+
+        Args:
+            other (QueryCache): The cache to merge in.
+        """
+        for query, entry in other._entries.items():
+            current = self._get_entry(query)
+            if current is None or current[1] < entry[1]:
+                self._set_entry(query, entry)
+
+    def update_from_dataset(self, dataset: dict) -> None:
+        """Adds every query/uri pair in dataset that isn't cached yet.
+           A found uri in dataset (Ex. a manual fix) also replaces a
+           cached miss.
+
+        Args:
+            dataset (dict): A dict with the same form as that returned by
+                build_dataset.
+        """
+        for date in dataset:
+            for item in dataset[date]:
+                entry = self._get_entry(item['query'])
+                if entry is None or (entry[0] is None and item['uri'] is not None):
+                    self[item['query']] = item['uri']
+
+    def save(self) -> None:
+        """Atomically writes the cache to self.path."""
+        with self._lock:
+            entries = dict(self._entries)
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(entries, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+
+# The fields kept for each miss, in the column order of the misses table
+MISS_FIELDS = ('rank', 'week', 'first_seen', 'last_seen', 'count', 'attempts', 'next_retry')
+
+
+class MissStore:
+    """Tracks queries that found no Spotify track, keyed by query.  Each
+       miss keeps its best rank, the week it was first missed, when it was
+       first and last seen, how many times it was seen and when it should
+       next be retried.  Every change is appended to an NDJSON log, which
+       is replayed on load, so nothing already written is ever rewritten
+       (see compact).  It can be passed as record_misses_list to the
+       build functions; iterating it yields the same (rank, week, query)
+       tuples as a miss list.
+
+    Args:
+        path (str): A path string (or path-like object) of the NDJSON log
+            backing the store.  Loaded if it exists.  If None, the store
+            is kept in memory only. Defaults to None.
+        base_delay (datetime.timedelta): The time before a miss is first
+            retried.  It doubles after each failed retry. Defaults to
+            1 week.
+        max_delay (datetime.timedelta): The longest time between retries.
+            Defaults to 26 weeks.
+    """
+    def __init__(self,
+                 path: str = None,
+                 base_delay: datetime.timedelta = datetime.timedelta(weeks=1),
+                 max_delay: datetime.timedelta = datetime.timedelta(weeks=26)):
+        self.path = path
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._entries = {}
+        if path and os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        self._apply(json.loads(line))
+
+    def __contains__(self, query: str) -> bool:
+        return query in self._entries
+
+    def __getitem__(self, query: str) -> dict:
+        return self._entries[query]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __iter__(self):
+        for query, entry in self._entries.items():
+            yield entry['rank'], entry['week'], query
+
+    def _apply(self, event: dict) -> None:
+        query = event['query']
+        if event['event'] == 'miss':
+            entry = self._entries.get(query)
+            if entry is None:
+                self._entries[query] = {'rank': event['rank'],
+                                        'week': event['week'],
+                                        'first_seen': event['time'],
+                                        'last_seen': event['time'],
+                                        'count': 1,
+                                        'attempts': 0,
+                                        'next_retry': event['next_retry']}
+            else:
+                if event['rank'] is not None and (entry['rank'] is None or event['rank'] < entry['rank']):
+                    entry['rank'] = event['rank']
+                entry['last_seen'] = event['time']
+                entry['count'] += 1
+        elif event['event'] == 'snapshot':
+            self._entries[query] = {field: event[field] for field in MISS_FIELDS}
+        elif event['event'] == 'retry' and query in self._entries:
+            self._entries[query]['attempts'] += 1
+            self._entries[query]['next_retry'] = event['next_retry']
+        elif event['event'] == 'resolved':
+            self._entries.pop(query, None)
+
+    def _log(self, event: dict) -> None:
+        self._apply(event)
+        if self.path:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(event, ensure_ascii=False) + '\n')
+
+    def record(self, query: str, rank: int = None, week=None) -> None:
+        """Records a miss of query.
+
+        Args:
+            query (str): The query that found no track.
+            rank (int): The chart position of the query's song. Defaults
+                to None.
+            week (datetime.date): The chart week of the miss (or an ISO
+                date string). Defaults to None.
+        """
+        now = datetime.datetime.now()
+        self._log({'event': 'miss',
+                   'query': query,
+                   'rank': rank,
+                   'week': str(week) if week is not None else None,
+                   'time': now.isoformat(timespec='seconds'),
+                   'next_retry': (now + self.base_delay).isoformat(timespec='seconds')})
+
+    def append(self, miss: tuple) -> None:
+        """Records a (rank, week, query) tuple, like list.append."""
+        rank, week, query = miss
+        self.record(query, rank, week)
+
+    def import_list(self, misses: list) -> int:
+        """Records the misses of a list in the (rank, week, query) form
+           pickled to query_misses.pickle, skipping queries already in the
+           store.  Tuples that were flattened into the list one element at
+           a time are regrouped.
+
+        Args:
+            misses (list): The list of misses.
+
+        Returns:
+            int: The number of misses added.
+        """
+        added = 0
+        for rank, week, query in _group_misses(misses):
+            if query not in self:
+                self.record(query, rank, week)
+                added += 1
+        return added
+
+    def resolve(self, query: str, uri: str) -> None:
+        """Removes query from the store once it has a uri."""
+        if query in self:
+            self._log({'event': 'resolved',
+                       'query': query,
+                       'uri': uri,
+                       'time': datetime.datetime.now().isoformat(timespec='seconds')})
+
+    def due(self, now: datetime.datetime = None) -> list:
+        """Returns the queries whose next retry is due, best rank first.
+
+        Args:
+            now (datetime.datetime): The current time. Defaults to None,
+                which uses datetime.datetime.now().
+        """
+        now = (now or datetime.datetime.now()).isoformat(timespec='seconds')
+        queries = [query for query, entry in self._entries.items() if entry['next_retry'] <= now]
+        return sorted(queries, key=lambda query: (self._entries[query]['rank'] is None,
+                                                  self._entries[query]['rank'] or 0))
+
+    def retry(self,
+              spotify_client: spotipy.Spotify,
+              query_cache: QueryCache = None,
+              limit: int = None,
+              now: datetime.datetime = None,
+              resolve: bool = True) -> dict:
+        """Searches Spotify again for the misses that are due.  Found
+           misses are resolved (and cached in query_cache).  The next retry
+           of the rest is pushed back exponentially, up to max_delay.
+
+        Args:
+            spotify_client (spotipy.Spotify): A Spotify client session used
+                for accessing Spotify's Web API.
+            query_cache (QueryCache): A cache updated with each retried
+                query's result. Defaults to None.
+            limit (int): The maximum number of misses retried. Defaults to
+                None, which retries every due miss.
+            now (datetime.datetime): The current time. Defaults to None,
+                which uses datetime.datetime.now().
+            resolve (bool): If False, found misses are left for the
+                caller to resolve once their uris are stored (Ex. with
+                set_stored_uris). Defaults to True.
+
+        Returns:
+            dict: The uri of each query that was found.
+        """
+        now = now or datetime.datetime.now()
+        found = {}
+        retried = self.due(now)[:limit]
+        for query in retried:
+            title, artist = query[len('track:'):].split(' artist:', maxsplit=1)
+            uri = _search_track_uri(title, artist, spotify_client)
+            if query_cache is not None:
+                query_cache[query] = uri
+            if uri is not None:
+                found[query] = uri
+                if resolve:
+                    self.resolve(query, uri)
+                continue
+            self._log({'event': 'retry',
+                       'query': query,
+                       'time': now.isoformat(timespec='seconds'),
+                       'next_retry': self._next_retry(self._entries[query], now)})
+        METRICS.increment('miss_retries_total', len(found), outcome='found')
+        METRICS.increment('miss_retries_total', len(retried) - len(found), outcome='missed')
+        return found
+
+    def _next_retry(self, entry: dict, now: datetime.datetime) -> str:
+        # The delay doubles with each failed retry, up to max_delay
+        delay = min(self.base_delay * 2 ** (entry['attempts'] + 1), self.max_delay)
+        return (now + delay).isoformat(timespec='seconds')
+
+    def compact(self) -> None:
+        """Atomically rewrites the log with one snapshot event per open
+           miss, dropping the history of resolved ones."""
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for query, entry in self._entries.items():
+                f.write(json.dumps({'event': 'snapshot', 'query': query, **entry},
+                                   ensure_ascii=False) + '\n')
+        os.replace(tmp_path, self.path)
+
+
+def _group_misses(misses: list) -> list:
+    """Returns the (rank, week, query) tuples of a miss list, regrouping
+       the tuples that were flattened into it one element at a time (as
+       in query_misses.pickle)."""
+    tuples = [item for item in misses if isinstance(item, tuple)]
+    loose = [item for item in misses if not isinstance(item, tuple)]
+    return tuples + [tuple(loose[i:i + 3]) for i in range(0, len(loose) - 2, 3)]
+
+
+class StateStore:
+    """A SQLite database (in WAL mode) holding the scraper's local state
+       between runs: the unique uris already uploaded, the query cache,
+       the query misses and the manual uri overrides.  Every table is
+       indexed by its key, each batch of writes is one transaction, and
+       concurrent runs are serialized by SQLite's write lock instead of
+       overwriting each other's files.
+
+    Args:
+        path (str): A path string (or path-like object) of the database
+            file.  It is created if it doesn't exist.
+        timeout (float): The number of seconds to wait for another
+            process's write to finish. Defaults to 30.
+    """
+    def __init__(self, path: str, timeout: float = 30):
+        self.path = path
+        self._lock = threading.RLock()
+        # Transactions are begun explicitly; see transaction
+        self._connection = sqlite3.connect(path,
+                                           timeout=timeout,
+                                           isolation_level=None,
+                                           check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        with self.transaction() as cursor:
+            cursor.execute('CREATE TABLE IF NOT EXISTS unique_uris '
+                           '(uri TEXT PRIMARY KEY) WITHOUT ROWID')
+            cursor.execute('CREATE TABLE IF NOT EXISTS query_cache '
+                           '(query TEXT PRIMARY KEY, uri TEXT, searched TEXT NOT NULL) WITHOUT ROWID')
+            cursor.execute('CREATE TABLE IF NOT EXISTS misses '
+                           '(query TEXT PRIMARY KEY, rank INTEGER, week TEXT, first_seen TEXT, '
+                           'last_seen TEXT, count INTEGER, attempts INTEGER, next_retry TEXT) WITHOUT ROWID')
+            cursor.execute('CREATE TABLE IF NOT EXISTS manual_uris '
+                           '(query TEXT PRIMARY KEY, uri TEXT) WITHOUT ROWID')
+            cursor.execute('CREATE TABLE IF NOT EXISTS applied_manual_uris '
+                           '(query TEXT PRIMARY KEY, uri TEXT) WITHOUT ROWID')
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """Runs the body of a with block as one write transaction, which
+           is committed at the end or rolled back on an exception.  Yields
+           a cursor."""
+        with self._lock:
+            cursor = self._connection.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            try:
+                yield cursor
+            except BaseException:
+                cursor.execute('ROLLBACK')
+                raise
+            cursor.execute('COMMIT')
+
+    def _query(self, sql: str, parameters: tuple = ()) -> list:
+        with self._lock:
+            return self._connection.execute(sql, parameters).fetchall()
+
+    def close(self) -> None:
+        """Closes the database connection."""
+        self._connection.close()
+
+    def has_uri(self, uri: str) -> bool:
+        """Checks if uri is in the unique uris."""
+        return bool(self._query('SELECT 1 FROM unique_uris WHERE uri = ?', (uri,)))
+
+    def get_new_uris(self, uris: set) -> set:
+        """Returns the uris that aren't in the unique uris yet."""
+        uris = list(uris)
+        known = set()
+        for batch in _chunks(uris, 500):
+            placeholders = ','.join('?' * len(batch))
+            known.update(row[0] for row in self._query(
+                f'SELECT uri FROM unique_uris WHERE uri IN ({placeholders})', tuple(batch)))
+        return set(uris) - known
+
+    def add_uris(self, uris: set) -> None:
+        """Adds uris to the unique uris in one transaction."""
+        with self.transaction() as cursor:
+            cursor.executemany('INSERT OR IGNORE INTO unique_uris VALUES (?)',
+                               ((uri,) for uri in uris))
+
+    def get_unique_uris(self) -> set:
+        """Returns every unique uri."""
+        return {row[0] for row in self._query('SELECT uri FROM unique_uris')}
+
+    def get_manual_uris(self) -> dict:
+        """Returns the manual uri overrides, keyed by query."""
+        return dict(self._query('SELECT query, uri FROM manual_uris'))
+
+    def set_manual_uris(self, uri_dict: dict) -> None:
+        """Adds or replaces manual uri overrides in one transaction.
+
+        Args:
+            uri_dict (dict): Keys are queries and values are uris (None
+                for songs known not to be on Spotify), as in
+                manual_uris_dict.json.
+        """
+        with self.transaction() as cursor:
+            cursor.executemany('INSERT OR REPLACE INTO manual_uris VALUES (?, ?)', uri_dict.items())
+
+    def get_unapplied_manual_uris(self) -> dict:
+        """Returns the manual uri overrides that were added or changed
+           since they were last marked as applied, keyed by query."""
+        return dict(self._query('SELECT manual.query, manual.uri FROM manual_uris AS manual '
+                                'LEFT JOIN applied_manual_uris AS applied ON applied.query = manual.query '
+                                'WHERE applied.query IS NULL OR applied.uri IS NOT manual.uri'))
+
+    def mark_manual_uris_applied(self, uri_dict: dict) -> None:
+        """Records manual uri overrides as applied to the stored
+           rankings, in one transaction."""
+        with self.transaction() as cursor:
+            cursor.executemany('INSERT OR REPLACE INTO applied_manual_uris VALUES (?, ?)', uri_dict.items())
+
+    def query_cache(self, negative_ttl: datetime.timedelta = None) -> 'SQLiteQueryCache':
+        """Returns a QueryCache backed by the query_cache table."""
+        return SQLiteQueryCache(self, negative_ttl=negative_ttl)
+
+    def miss_store(self, **kwargs) -> 'SQLiteMissStore':
+        """Returns a MissStore backed by the misses table.  kwargs are
+           passed to MissStore."""
+        return SQLiteMissStore(self, **kwargs)
+
+    def import_files(self, directory: str) -> dict:
+        """One-shot import of the pickle and JSON files kept in
+           json-files before this store existed.  Files that don't exist
+           are skipped, and existing rows are kept.
+
+        Args:
+            directory (str): A path string (or path-like object) of the
+                directory holding unique_uris.pickle, query_cache.json,
+                query_misses.ndjson (or query_misses.pickle) and
+                manual_uris_dict.json.
+
+        Returns:
+            dict: The number of entries read from each file, keyed by
+                table name.
+        """
+        counts = {}
+        path = os.path.join(directory, 'unique_uris.pickle')
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                uris = pickle.load(f)
+            self.add_uris(uris)
+            counts['unique_uris'] = len(uris)
+
+        path = os.path.join(directory, 'query_cache.json')
+        if os.path.exists(path):
+            entries = QueryCache(path)._entries
+            with self.transaction() as cursor:
+                cursor.executemany('INSERT OR IGNORE INTO query_cache VALUES (?, ?, ?)',
+                                   ((query, uri, searched) for query, (uri, searched) in entries.items()))
+            counts['query_cache'] = len(entries)
+
+        misses = self.miss_store()
+        path = os.path.join(directory, 'query_misses.ndjson')
+        legacy_path = os.path.join(directory, 'query_misses.pickle')
+        if os.path.exists(path):
+            imported = MissStore(path)
+            for query, entry in imported._entries.items():
+                if query not in misses:
+                    misses._entries[query] = entry
+                    self._save_miss(query, entry)
+            counts['misses'] = len(imported)
+        elif os.path.exists(legacy_path):
+            with open(legacy_path, 'rb') as f:
+                counts['misses'] = misses.import_list(pickle.load(f))
+
+        path = os.path.join(directory, 'manual_uris_dict.json')
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                manual_uris = json.load(f)
+            with self.transaction() as cursor:
+                cursor.executemany('INSERT OR IGNORE INTO manual_uris VALUES (?, ?)', manual_uris.items())
+            counts['manual_uris'] = len(manual_uris)
+        return counts
+
+    def _save_miss(self, query: str, entry: dict = None) -> None:
+        with self.transaction() as cursor:
+            self._write_miss(cursor, query, entry)
+
+    @staticmethod
+    def _write_miss(cursor, query: str, entry: dict = None) -> None:
+        if entry is None:
+            cursor.execute('DELETE FROM misses WHERE query = ?', (query,))
+        else:
+            cursor.execute('INSERT OR REPLACE INTO misses VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                           (query, *(entry[field] for field in MISS_FIELDS)))
+
+
+class SQLiteQueryCache(QueryCache):
+    """A QueryCache whose entries live in a StateStore's query_cache
+       table.  Each write is committed immediately, so save does
+       nothing.  It can't be sent to other processes; give
+       build_dataset_sharded a plain QueryCache.
+
+    Args:
+        store (StateStore): The store holding the entries.
+        negative_ttl (datetime.timedelta): How long a known miss is
+            trusted before it is searched again.  If None, misses never
+            expire. Defaults to None.
+    """
+    def __init__(self, store: StateStore, negative_ttl: datetime.timedelta = None):
+        super().__init__(path=None, negative_ttl=negative_ttl)
+        self.store = store
+
+    def __len__(self) -> int:
+        return self.store._query('SELECT COUNT(*) FROM query_cache')[0][0]
+
+    def _get_entry(self, query: str) -> tuple:
+        rows = self.store._query('SELECT uri, searched FROM query_cache WHERE query = ?', (query,))
+        return rows[0] if rows else None
+
+    def _set_entry(self, query: str, entry: tuple) -> None:
+        with self.store.transaction() as cursor:
+            cursor.execute('INSERT OR REPLACE INTO query_cache VALUES (?, ?, ?)', (query, *entry))
+
+    def save(self) -> None:
+        """Does nothing; every write is already committed."""
+
+
+class SQLiteMissStore(MissStore):
+    """A MissStore whose misses live in a StateStore's misses table
+       instead of an NDJSON log.  Each change re-reads the miss's row
+       and upserts (or deletes) it in one write transaction, so the
+       counts of overlapping runs add up instead of overwriting each
+       other.  The misses read by due are reloaded from the table.
+
+    Args:
+        store (StateStore): The store holding the misses.
+        **kwargs: base_delay and max_delay, as for MissStore.
+    """
+    def __init__(self, store: StateStore, **kwargs):
+        super().__init__(path=None, **kwargs)
+        self.store = store
+        self._load()
+
+    def __contains__(self, query: str) -> bool:
+        return bool(self.store._query('SELECT 1 FROM misses WHERE query = ?', (query,)))
+
+    def __len__(self) -> int:
+        return self.store._query('SELECT COUNT(*) FROM misses')[0][0]
+
+    def _load(self) -> None:
+        self._entries = {row[0]: dict(zip(MISS_FIELDS, row[1:]))
+                         for row in self.store._query('SELECT * FROM misses')}
+
+    def _log(self, event: dict) -> None:
+        query = event['query']
+        with self.store.transaction() as cursor:
+            row = cursor.execute('SELECT * FROM misses WHERE query = ?', (query,)).fetchone()
+            if row is None:
+                self._entries.pop(query, None)
+            else:
+                self._entries[query] = dict(zip(MISS_FIELDS, row[1:]))
+                if event['event'] == 'retry':
+                    # Back off from the attempts of every run, not this one's
+                    event['next_retry'] = self._next_retry(self._entries[query],
+                                                           datetime.datetime.fromisoformat(event['time']))
+            self._apply(event)
+            self.store._write_miss(cursor, query, self._entries.get(query))
+
+    def due(self, now: datetime.datetime = None) -> list:
+        self._load()
+        return super().due(now)
+
+    def compact(self) -> None:
+        """Does nothing; rows are updated in place."""
+
+
+class ChartEntry(collections.abc.Mapping):
+    """A compact, dict-like ranking item for holding large datasets in
+       memory.  Fields live in __slots__ instead of a per-item dict, and
+       strings are interned, so a song's title, artist, query and uri
+       are stored once no matter how many weeks it charts.  Read it like
+       the item dicts of build_dataset (entry['uri'], 'uri' in entry,
+       dict(entry)) and set existing keys with entry[key] = value.  The
+       only key that can be added is 'spotify_info'.
+
+    Args:
+        title (str): The raw track title.
+        artist (str): The raw track artist name.
+        query (str): The Spotify search query.
+        uri (str): The track uri, or None if the query missed.
+        spotify_info (dict): The track's Spotify info, as added by
+            add_spotify_info_inline.  Defaults to unset.
+    """
+    __slots__ = ('title', 'artist', 'query', 'uri', 'spotify_info')
+
+    def __init__(self, title: str, artist: str, query: str, uri: str, **kwargs):
+        self.title = sys.intern(title)
+        self.artist = sys.intern(artist)
+        self.query = sys.intern(query)
+        self.uri = sys.intern(uri) if uri is not None else None
+        for key, value in kwargs.items():
+            self[key] = value
+
+    def __getitem__(self, key: str):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __setitem__(self, key: str, value) -> None:
+        if key not in self.__slots__:
+            raise KeyError(key)
+        if isinstance(value, str):
+            value = sys.intern(value)
+        setattr(self, key, value)
+
+    def __iter__(self):
+        return (key for key in self.__slots__ if hasattr(self, key))
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __repr__(self) -> str:
+        return f'ChartEntry({self.to_dict()!r})'
+
+    def __getstate__(self) -> dict:
+        return self.to_dict()
+
+    def __setstate__(self, state: dict) -> None:
+        for key, value in state.items():
+            self[key] = value
+
+    def to_dict(self) -> dict:
+        """Returns the entry as a build_dataset item dict."""
+        return {key: getattr(self, key) for key in self}
+
+    @classmethod
+    def from_dict(cls, item: dict) -> 'ChartEntry':
+        """Makes an entry from a build_dataset item dict."""
+        return cls(**item)
+
+
+def compact_dataset(dataset: dict) -> dict:
+    """Converts every item of a dataset to a ChartEntry.
+
+    Args:
+        dataset (dict): A dict with the same form as that returned by
+            build_dataset.
+
+    Returns:
+        dict: A ValidatedDataset of the same weeks whose items are
+            ChartEntry objects.  Spotify info is shared, not copied.
+    """
+    return ValidatedDataset((date, [item if isinstance(item, ChartEntry) else ChartEntry.from_dict(item)
+                                    for item in dataset[date]])
+                            for date in dataset)
+
+
+def expand_dataset(dataset: dict) -> dict:
+    """Converts every ChartEntry of a dataset back to a plain dict.
+
+    Args:
+        dataset (dict): A dict with the same form as that returned by
+            build_dataset, possibly holding ChartEntry items.
+
+    Returns:
+        dict: A ValidatedDataset of the same weeks whose items are dicts.
+    """
+    return ValidatedDataset((date, [item.to_dict() if isinstance(item, ChartEntry) else item
+                                    for item in dataset[date]])
+                            for date in dataset)
+
+
+class ValidatedDataset(dict):
+    """A dataset that checks each week once, when it is inserted, so
+       valid_dataset doesn't have to check every week again on each
+       call.  Behaves like, and can be used anywhere as, the dict
+       returned by build_dataset.  Items edited in place after insertion
+       are not checked again.
+
+    Args:
+        Same as dict. Every week is checked on insertion.
+
+    Raises:
+        InvalidInputException: If an inserted week is invalid.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__()
+        self.update(*args, **kwargs)
+
+    def __setitem__(self, date: str, ranking: list) -> None:
+        if not valid_week(date, ranking):
+            raise InvalidInputException
+        super().__setitem__(date, ranking)
+
+    def update(self, *args, **kwargs) -> None:
+        for date, ranking in dict(*args, **kwargs).items():
+            self[date] = ranking
+
+    def setdefault(self, date: str, ranking: list = None) -> list:
+        if date not in self:
+            self[date] = ranking
+        return self[date]
+
+
+class DatasetIndex:
+    """An inverted index from queries and uris to the places they appear
+       in a dataset, so lookups and manual fixes touch only the affected
+       items instead of scanning every week.  Locations are
+       (date, position) tuples.  The index only sees changes made
+       through add_week and set_uri; rebuild it after editing the
+       dataset any other way.
+
+    Args:
+        dataset (dict): A dict with the same form as that returned by
+            build_dataset to index. Defaults to None.
+    """
+    def __init__(self, dataset: dict = None):
+        self.dataset = dataset if dataset is not None else {}
+        self._queries = collections.defaultdict(dict)
+        self._uris = collections.defaultdict(dict)
+        self._rankings = {}
+        for date in list(self.dataset):
+            self.add_week(date, self.dataset[date])
+
+    def add_week(self, date: str, ranking: list) -> None:
+        """Indexes a new or replaced week of the dataset.
+
+        Args:
+            date (str): An ISO-formatted (YYYY-MM-DD) date string.
+            ranking (list): The week's list of items, with the same form
+                as the values of the dict returned by build_dataset.
+        """
+        self.remove_week(date)
+        self.dataset[date] = ranking
+        self._rankings[date] = ranking
+        for position, item in enumerate(ranking):
+            self._queries[item['query']].setdefault(date, []).append(position)
+            self._uris[item['uri']].setdefault(date, []).append(position)
+
+    def remove_week(self, date: str) -> None:
+        """Removes a week from the index, if it is indexed.
+
+        Args:
+            date (str): An ISO-formatted (YYYY-MM-DD) date string.
+        """
+        for item in self._rankings.pop(date, []):
+            for key, locations in ((item['query'], self._queries), (item['uri'], self._uris)):
+                locations[key].pop(date, None)
+                if not locations[key]:
+                    del locations[key]
+
+    def query_locations(self, query: str) -> list:
+        """Returns the (date, position) of every item with query."""
+        return [(date, position)
+                for date, positions in self._queries.get(query, {}).items()
+                for position in positions]
+
+    def uri_locations(self, uri: str) -> list:
+        """Returns the (date, position) of every item with uri."""
+        return [(date, position)
+                for date, positions in self._uris.get(uri, {}).items()
+                for position in positions]
+
+    def set_uri(self, query: str, uri: str) -> int:
+        """Sets the uri of every item with query, keeping the index
+           up to date.
+
+        Args:
+            query (str): Spotify query string
+                (Ex. "track:Rock With You artist:Michael Jackson").
+            uri (str): Spotify URI string
+                (Ex. "spotify:track:0SErdEdRcVX1uJCf1eTGYH").
+
+        Returns:
+            int: The number of items updated.
+        """
+        locations = self.query_locations(query)
+        for date, position in locations:
+            item = self.dataset[date][position]
+            old_positions = self._uris[item['uri']][date]
+            old_positions.remove(position)
+            if not old_positions:
+                del self._uris[item['uri']][date]
+                if not self._uris[item['uri']]:
+                    del self._uris[item['uri']]
+            item['uri'] = uri
+            self._uris[uri].setdefault(date, []).append(position)
+        return len(locations)
+
+    @property
+    def queries(self) -> set:
+        """The set of all indexed queries."""
+        return set(self._queries)
+
+    @property
+    def uris(self) -> set:
+        """The set of all indexed uris, excluding None."""
+        return {uri for uri in self._uris if uri}
+
+
+class TrackMatchIndex:
+    """A local fuzzy-search index over known Spotify tracks, so chart
+       entries whose track is already known (under a slightly different
+       query) are resolved without a Spotify search.  Candidates are the
+       tracks with the same title or sharing an artist word, ignoring
+       words shared by too many tracks to narrow anything down (Ex.
+       "the").  Titles are
+       compared by the Dice similarity of their character trigrams and
+       artists by how many of the query's artist words the track's
+       artists contain.
+       Names are normalized the same way on both sides: lowercased,
+       without apostrophes, parentheticals or " - Remastered"-style
+       suffixes, and with punctuation turned into spaces.  match only
+       accepts tracks with the same normalized title; candidates and
+       propose also return similar titles, for review.
+
+    Args:
+        spotify_info_dict (dict): A dict with the same form as that
+            returned by get_spotify_info whose tracks are indexed.
+            Defaults to None.
+        threshold (float): The lowest score (0 to 1) match accepts.
+            Defaults to 0.9.
+        title_weight (float): The weight of the title similarity in the
+            score; the artist similarity gets the rest. Defaults to 0.6.
+    """
+    def __init__(self,
+                 spotify_info_dict: dict = None,
+                 threshold: float = 0.9,
+                 title_weight: float = 0.6):
+        self.threshold = threshold
+        self.title_weight = title_weight
+        self._tracks = []
+        self._titles = collections.defaultdict(set)
+        self._artist_words = collections.defaultdict(set)
+        for uri, spotify_info in (spotify_info_dict or {}).items():
+            track_info = spotify_info['track_info']
+            self.add(uri, track_info['name'], [artist['name'] for artist in track_info['artists']])
+
+    def __len__(self) -> int:
+        return len(self._tracks)
+
+    @staticmethod
+    def _normalize(name: str) -> str:
+        name = name.lower().replace("'", '').replace('\u2019', '').split(' - ', maxsplit=1)[0]
+        name = PARENTH_PATTERN.sub(' ', name)
+        return ' '.join(re.sub(r'[^\w]+', ' ', name).split())
+
+    @staticmethod
+    def _get_trigrams(name: str) -> set:
+        padded = f'  {name} '
+        return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+    def add(self, uri: str, title: str, artists: list) -> None:
+        """Indexes one track.
+
+        Args:
+            uri (str): The track's uri.
+            title (str): The track's name.
+            artists (list): The names of the track's artists.
+        """
+        title = self._normalize(title)
+        trigrams = self._get_trigrams(title)
+        artist_words = set(self._normalize(' '.join(artists)).split())
+        position = len(self._tracks)
+        self._tracks.append((uri, trigrams, artist_words))
+        self._titles[title].add(position)
+        for word in artist_words:
+            self._artist_words[word].add(position)
+
+    def candidates(self, title: str, artist: str, limit: int = 5) -> list:
+        """Finds the known tracks most similar to a chart entry.
+
+        Args:
+            title (str): A track title (preferably cleaned).
+            artist (str): A track artist (preferably cleaned).
+            limit (int): The maximum number of candidates returned.
+                Defaults to 5.
+
+        Returns:
+            list: Up to limit (uri, score) tuples, best score first.
+        """
+        title = self._normalize(title)
+        trigrams = self._get_trigrams(title)
+        artist_words = set(self._normalize(artist).split())
+        positions = set(self._titles.get(title, ()))
+        common = max(100, len(self._tracks) // 50)
+        for word in artist_words:
+            if len(self._artist_words.get(word, ())) <= common:
+                positions |= self._artist_words.get(word, set())
+
+        scores = {}
+        for position in positions:
+            uri, track_trigrams, track_artist_words = self._tracks[position]
+            title_score = 2 * len(trigrams & track_trigrams) / (len(trigrams) + len(track_trigrams))
+            artist_score = (len(artist_words & track_artist_words) / len(artist_words)
+                            if artist_words else 0.0)
+            score = self.title_weight * title_score + (1 - self.title_weight) * artist_score
+            scores[uri] = max(score, scores.get(uri, 0.0))
+        return sorted(scores.items(), key=lambda item: -item[1])[:limit]
+
+    def match(self, title: str, artist: str) -> str:
+        """Returns the uri of the best known track for a chart entry if
+           its score is at least threshold and its normalized title has
+           the same words, else None.  A similar title isn't enough to
+           skip a search, since it is often a different song by the same
+           artist (Ex. "Love Me" for "Love Me Do")."""
+        same_title = {self._tracks[position][0] for position in self._titles.get(self._normalize(title), ())}
+        if not same_title:
+            return None
+        for uri, score in self.candidates(title, artist, limit=len(self._tracks)):
+            if score < self.threshold:
+                break
+            if uri in same_title:
+                return uri
+        return None
+
+    def propose(self, misses, limit: int = 3) -> dict:
+        """Proposes candidate tracks for recorded query misses, for
+           reviewing offline before adding them to manual_uris_dict.json.
+
+        Args:
+            misses: A list of (rank, week, query) tuples (Ex. the list in
+                query_misses.pickle, whose flattened tuples are
+                regrouped as in MissStore.import_list) or a MissStore.
+            limit (int): The maximum number of candidates per miss.
+                Defaults to 3.
+
+        Returns:
+            dict: Keys are the missed queries and values are lists of
+                (uri, score) tuples, best score first.  Misses without
+                any candidate are left out.
+        """
+        if not isinstance(misses, MissStore):
+            misses = _group_misses(misses)
+        proposals = {}
+        for miss in misses:
+            query = miss[-1]
+            title, artist = query[len('track:'):].split(' artist:', maxsplit=1)
+            found = self.candidates(title, artist, limit=limit)
+            if found:
+                proposals[query] = found
+        return proposals
+
+
 def _get_track_uris(titles: list,
                     artists: list,
                     historical_data: dict,
@@ -149,7 +1798,10 @@ def _get_track_uris(titles: list,
                     prev_week: str = None,
                     debug: bool = False,
                     record_misses_list: list = None,
-                    day_of_the_week: int = 2) -> tuple:
+                    day_of_the_week: int = 2,
+                    query_cache: QueryCache = None,
+                    match_index: TrackMatchIndex = None,
+                    date: str = None) -> tuple:
     """Gets Spotify track URIs from track titles and artists.
 
     Args:
@@ -166,11 +1818,19 @@ def _get_track_uris(titles: list,
         prev_week (str): An ISO-formatted (YYYY-MM-DD) date string of the
             previous week. Defaults to None.
         debug (bool): If True, prints missed queries. Defaults to False.
-        record_misses_list (list): A list where the query misses are
-            recorded. Defaults to None.
+        record_misses_list (list): A list (or MissStore) where the query
+            misses are recorded. Defaults to None.
         day_of_the_week (int): Indicates the Python day of the week
             (Ex. 0 is Monday, 1 is Tuesday, ..., 6 is Sunday). Defaults
             to 2 (Wednesday).
+        query_cache (QueryCache): A cache of previously searched queries
+            that is checked before searching Spotify, and updated with the
+            result of every new search. Defaults to None.
+        match_index (TrackMatchIndex): An index of known tracks that is
+            checked before searching Spotify. Defaults to None.
+        date (str): An ISO-formatted (YYYY-MM-DD) date string of the
+            chart week, recorded with each miss. Defaults to None, which
+            records this week's chart date.
 
     Returns:
         tuple: A 2-arg tuple where the first arg is a list of the search
@@ -192,184 +1852,1034 @@ def _get_track_uris(titles: list,
                for title, artist in zip(titles, artists)]
     
     # Get previous week's queries and uris
-    if prev_week:
+    prev_queries = {}
+    if prev_week and prev_week in historical_data:
         prev_queries = {item['query']: item['uri'] for item in historical_data[prev_week]}
     
     # Search for uris via Spotify Web API
     uris = []
     for i, query in enumerate(queries):
-        # Use previous week's uri
-        if prev_week and query in prev_queries:
+        # Use a cached or previous week's uri.  A cached miss must not
+        # hide a uri the previous week has (Ex. from a manual fix)
+        cached = query_cache is not None and query in query_cache
+        if cached and query_cache[query] is not None:
+            METRICS.increment('track_uri_lookups_total', source='query_cache')
+            uri = query_cache[query]
+        elif query in prev_queries:
+            METRICS.increment('track_uri_lookups_total', source='prev_week')
             uri = prev_queries[query]
+            if query_cache is not None:
+                query_cache[query] = uri
+        elif cached:
+            METRICS.increment('track_uri_lookups_total', source='query_cache')
+            uri = None
         else:
-            found_tracks = spotify_client.search(q=query, type='track')
-            items = found_tracks['tracks']['items']
-            # Take first (most popular) uri
-            if len(items) > 0:
-                uri = items[0]['uri']
+            uri = match_index.match(titles[i], artists[i]) if match_index is not None else None
+            if uri is not None:
+                METRICS.increment('track_uri_lookups_total', source='match_index')
             else:
-                # Try the track query plus only the first part of artist query
-                new_query = 'track:' + titles[i] + ' artist:'
-                if len(artists[i]) > 0:
-                    trunc_artist = artists[i].split()[0]
-                    new_query += trunc_artist
-                found_tracks = spotify.search(q=new_query, type='track')
-                items = found_tracks['tracks']['items']
-                if len(items) > 0:
-                    uri = items[0]['uri']
-                # New query is still unsuccessful...set uri to None
-                else:
-                    if record_misses_list is not None:
-                        prev_misses = [item[-1] for item in record_misses_list]
-                        if query not in prev_misses:
-                            current_week = datetime.date.today()
-                            current_day = current_week.weekday()
-                            if current_day != day_of_the_week:
-                                current_week += datetime.timedelta(days=day_of_the_week - current_day)
-                            record_misses_list.append((i, current_week, query))
-                    if debug:
-                        print(i, new_query)
-                    uri = None
+                uri = _search_track_uri(titles[i], artists[i], spotify_client)
+            if uri is None:
+                _record_miss(i, query, record_misses_list, day_of_the_week, week=date)
+                if debug:
+                    print(i, query)
+            if query_cache is not None:
+                query_cache[query] = uri
+
+        uris.append(uri)
+
+    return queries, uris
+
+
+def _search_track_uri(title: str,
+                      artist: str,
+                      spotify_client: spotipy.Spotify) -> str:
+    """Searches Spotify for the uri of one track, retrying with only the
+       first word of the artist if the full query finds nothing.
+
+    Args:
+        title (str): A cleaned track title.
+        artist (str): A cleaned track artist name.
+        spotify_client (spotipy.Spotify): A Spotify client session used for
+            accessing Spotify's Web API.
+
+    Returns:
+        str: The uri of the first (most popular) track found, or None if
+            neither search found a track.
+    """
+    query = 'track:' + title + ' artist:' + artist
+    with METRICS.timer('spotify_search_seconds'):
+        found_tracks = spotify_client.search(q=query, type='track')
+    items = found_tracks['tracks']['items']
+    # Take first (most popular) uri
+    if len(items) > 0:
+        METRICS.increment('track_uri_lookups_total', source='search')
+        return items[0]['uri']
+
+    # Try the track query plus only the first part of artist query
+    new_query = 'track:' + title + ' artist:'
+    if len(artist) > 0:
+        trunc_artist = artist.split()[0]
+        new_query += trunc_artist
+    with METRICS.timer('spotify_search_seconds'):
+        found_tracks = spotify_client.search(q=new_query, type='track')
+    items = found_tracks['tracks']['items']
+    if len(items) > 0:
+        METRICS.increment('track_uri_lookups_total', source='fallback_search')
+        return items[0]['uri']
+
+    # New query is still unsuccessful...set uri to None
+    METRICS.increment('track_uri_lookups_total', source='miss')
+    return None
+
+
+def _record_miss(rank: int,
+                 query: str,
+                 record_misses_list: list = None,
+                 day_of_the_week: int = 2,
+                 week=None) -> None:
+    """Appends a (rank, week, query) tuple for a query that found no
+       track to record_misses_list, unless the query is already in it.
+       A MissStore records every miss, updating the counts of known ones.
+       week is the chart week of the miss (a datetime.date or an ISO date
+       string); if None, this week's chart date is used.
+    """
+    if record_misses_list is None:
+        return
+    if week is None:
+        week = datetime.date.today()
+        current_day = week.weekday()
+        if current_day != day_of_the_week:
+            week += datetime.timedelta(days=day_of_the_week - current_day)
+    elif isinstance(week, str):
+        week = datetime.date.fromisoformat(week)
+    if isinstance(record_misses_list, MissStore):
+        record_misses_list.record(query, rank, week)
+    elif query not in {item[-1] for item in record_misses_list}:
+        record_misses_list.append((rank, week, query))
+
+
+def _get_week_dates(start_date: datetime.date,
+                    end_date: datetime.date,
+                    dataset: dict,
+                    refresh: bool = True,
+                    day_of_the_week: int = 2) -> list:
+    """Finds the chart weeks that build_dataset should build.
+
+    Args:
+        start_date (datetime.date): Indicates the starting week for the
+            dataset (inclusive).
+        end_date (datetime.date): Indicates the ending week for the
+            dataset (inclusive).
+        dataset (dict): A dict with the same form as that returned by
+            build_dataset that is being extended or refreshed.
+        refresh (bool): If True, indicates that dataset should be
+            updated.  Defaults to True.
+        day_of_the_week (int): Indicates the Python day of the week
+            (Ex. 0 is Monday, 1 is Tuesday, ..., 6 is Sunday). Defaults
+            to 2 (Wednesday).
+
+    Returns:
+        list: ISO-formatted (YYYY-MM-DD) date strings of each week, in
+            order.
+
+    Raises:
+        InvalidInputException: If start_date and/or end_date are invalid.
+    """
+    # Convert dates to datetime.date objects
+    try:
+        if not isinstance(start_date, datetime.date):
+            start_date = datetime.date.fromisoformat(start_date)
+        if not isinstance(end_date, datetime.date):
+            end_date = datetime.date.fromisoformat(end_date)
+    except ValueError:
+        print('Invalid start or end dates')
+        raise InvalidInputException
+
+    # Either extend or refresh the historical data
+    if len(dataset) > 0:
+        index = 0 if refresh else -1
+        first_week = datetime.date.fromisoformat(list(dataset)[index])
+        if refresh and first_week < start_date:
+            start_date = first_week
+    
+    # Verify that dates are valid and restrict them to reasonable values
+    if (start_date > end_date):
+        print("Start date must be on or before end date...")
+        raise InvalidInputException
+    if (start_date < datetime.date(1960, 1, 1)):
+        start_date = datetime.date(1960, 1, 1)
+    if (end_date > datetime.date.today()):
+        end_date = datetime.date.today()
+    
+    # Center weeks on provided day of the week
+    if day_of_the_week:
+        if end_date.weekday() != day_of_the_week:
+            end_date += datetime.timedelta(days=day_of_the_week - end_date.weekday())
+        if start_date.weekday() != day_of_the_week:
+            start_date += datetime.timedelta(days=day_of_the_week - start_date.weekday())
+    
+    # Find all dates b/w start and end
+    week = datetime.timedelta(weeks=1)
+    dates = [str(start_date)]
+    while start_date <= end_date:
+        start_date += week
+        if start_date > end_date:
+            break
+        dates.append(str(start_date))
+
+    return dates
+
+
+def _save_checkpoint(path: str,
+                     dataset: dict,
+                     completed: list,
+                     record_misses_list: list = None,
+                     query_cache: QueryCache = None) -> None:
+    """Atomically saves the state of a build_dataset run to path.
+
+    Args:
+        path (str): A path string (or path-like object) of the checkpoint
+            file.
+        dataset (dict): A dict with the same form as that returned by
+            build_dataset.
+        completed (list): ISO-formatted (YYYY-MM-DD) date strings of the
+            weeks finished so far.
+        record_misses_list (list): A list (or MissStore) where the query
+            misses are recorded. Defaults to None.
+        query_cache (QueryCache): Saved too if it has a path. Defaults
+            to None.
+    """
+    checkpoint = {'dataset': dataset,
+                  'completed': completed,
+                  'misses': list(record_misses_list) if record_misses_list is not None else []}
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(checkpoint, f)
+    os.replace(tmp_path, path)
+    if query_cache is not None and query_cache.path:
+        query_cache.save()
+
+
+def load_checkpoint(path: str) -> dict:
+    """Loads a checkpoint written by build_dataset.
+
+    Args:
+        path (str): A path string (or path-like object) of the checkpoint
+            file.
+
+    Returns:
+        dict: A dict of the form: {'dataset': dataset,
+                                   'completed': completed,
+                                   'misses': record_misses_list} ,
+            where completed lists the ISO dates of the finished weeks.
+    """
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+def build_dataset(start_date: datetime.date,
+                  end_date: datetime.date,
+                  spotify_client: spotipy.Spotify,
+                  http_session: requests.Session,
+                  historical_data: dict = None,
+                  refresh: bool = True,
+                  debug: bool = False,
+                  record_misses_list: list = None,
+                  top_k: int = 50,
+                  day_of_the_week: int = 2,
+                  max_workers: int = 1,
+                  query_cache: QueryCache = None,
+                  checkpoint_path: str = None,
+                  checkpoint_every: int = 50,
+                  resume: bool = False,
+                  index: DatasetIndex = None,
+                  page_cache: ChartPageCache = None,
+                  match_index: TrackMatchIndex = None,
+                  compact: bool = False,
+                  extractor: ChartPageExtractor = None) -> dict:
+    """Builds a dataset of weekly Billboard charts.
+
+    Args:
+        start_date (datetime.date): Indicates the starting week for the
+            dataset (inclusive).
+        start_date (datetime.date): Indicates the ending week for the
+            dataset (inclusive).
+        spotify_client (spotipy.Spotify): A Spotify client session used for
+            accessing Spotify's Web API.
+        http_session (requests.Session): The HTTP session used to send GET
+            requests to Billboard.
+        historical_data: A dict with the same form as that returned by
+            build_dataset.  It is used as a cache where the previous week's
+            data is used if possible to prevent unnecessary expensive
+            queries to Spotify.  Pass a ValidatedDataset to skip checking
+            every week again.  Defaults to None, which starts a new
+            ValidatedDataset.
+        refresh (bool): If True, indicates that historical_data should be
+            updated.  Defaults to True.
+        debug (bool): If True, prints missed queries and finished dates.
+            Defaults to False.
+        record_misses_list (list): A list (or MissStore) where the query
+            misses are recorded. Defaults to None.
+        top_k (int): Each week in the dataset will have the top_k of the
+            Billboard Hot 100. Defaults to 50.
+        day_of_the_week (int): Indicates the Python day of the week
+            (Ex. 0 is Monday, 1 is Tuesday, ..., 6 is Sunday). Defaults
+            to 2 (Wednesday).
+        max_workers (int): The maximum number of Billboard pages
+            downloaded at once.  Pages are still processed in date order,
+            so the previous week's uris are reused exactly as in a serial
+            run.  Cap the per-host request rate with the
+            max_requests_per_second arg of create_http_session.
+            Defaults to 1.
+        query_cache (QueryCache): A cache of query/uri pairs shared across
+            weeks and runs, so only new queries are searched on Spotify.
+            Defaults to None.
+        checkpoint_path (str): A path string (or path-like object) of a
+            checkpoint file holding the finished weeks, the dataset and
+            record_misses_list.  It is atomically rewritten every
+            checkpoint_every finished weeks and when the build stops,
+            including on errors and Ctrl-C.  query_cache is saved
+            alongside it if it has a path.  If None, no checkpoints are
+            written. Defaults to None.
+        checkpoint_every (int): The number of finished weeks between
+            checkpoints. Defaults to 50.
+        resume (bool): If True and checkpoint_path exists, restores the
+            checkpoint and skips the weeks it has already finished.
+            Defaults to False.
+        index (DatasetIndex): An index of historical_data that is updated
+            as each week is built. Defaults to None.
+        page_cache (ChartPageCache): A cache of chart pages, so settled
+            weeks are never downloaded twice. Defaults to None.
+        match_index (TrackMatchIndex): An index of known tracks that is
+            checked before searching Spotify. Defaults to None.
+        compact (bool): If True, built items are ChartEntry objects
+            instead of dicts. Defaults to False.
+        extractor (ChartPageExtractor): The extractor matching the chart
+            pages' markup. Defaults to None, which uses
+            CHART_PAGE_EXTRACTOR.
+
+    Returns:
+        dict: Keys are ISO dates (YYYY-MM-DD) indicating the week of the
+            chart and values are dicts of the form: {'title': title,
+                                                     'artist': artist,
+                                                     'query': query,
+                                                     'uri': uri} .
+
+    Raises:
+        InvalidInputException: If historical_data is given in an invalid
+            format, or if start_date and/or end_date are invalid.
+    """
+    dataset = historical_data if historical_data is not None else ValidatedDataset()
+    # Historical data must be a valid dataset that built weeks can be added to
+    if len(dataset) > 0 and not valid_dataset(dataset):
+        print('Historical data must be a valid dataset')
+        raise InvalidInputException
+    if not isinstance(dataset, collections.abc.MutableMapping):
+        print('Historical data must be mutable (Ex. ColumnarDataset.to_dict())')
+        raise InvalidInputException
+
+    # Restore the weeks finished before the last checkpoint
+    completed = []
+    if resume and checkpoint_path and os.path.exists(checkpoint_path):
+        checkpoint = load_checkpoint(checkpoint_path)
+        dataset.update(checkpoint['dataset'])
+        completed = checkpoint['completed']
+        if isinstance(record_misses_list, MissStore):
+            record_misses_list.import_list(checkpoint['misses'])
+        elif record_misses_list is not None:
+            record_misses_list[:] = checkpoint['misses']
+    finished_dates = set(completed)
+
+    dates = _get_week_dates(start_date,
+                            end_date,
+                            dataset,
+                            refresh=refresh,
+                            day_of_the_week=day_of_the_week)
+    week = datetime.timedelta(weeks=1)
+
+    # If refreshing, re-use titles and artists to prevent http GET request
+    reused_dates = {date for date in dates
+                    if refresh and date in dataset and top_k <= len(dataset[date])}
+    track_infos = _iter_track_info(session=http_session,
+                                   dates=[date for date in dates
+                                          if date not in reused_dates and date not in finished_dates],
+                                   upper_bound=top_k,
+                                   max_workers=max_workers,
+                                   page_cache=page_cache,
+                                   extractor=extractor)
+
+    # Build the date dict and return it
+    try:
+        for i, date in enumerate(dates, 1):
+            if date in finished_dates:
+                continue
+            if date in reused_dates:
+                titles, artists = zip(*[(item['title'], item['artist']) for item in dataset[date]])
+            else:
+                titles, artists = next(track_infos)
+        
+            # Reformat title and artist strings to be compatible with Spotify API search
+            with METRICS.timer('clean_seconds'):
+                clean_titles, clean_artists = NAME_NORMALIZER.clean(titles, artists)
+            prev_week = str(datetime.date.fromisoformat(date) - week) if i > 1 else None
+            # Only the previous week is needed, so only it is checked
+            queries, uris = _get_track_uris(clean_titles,
+                                            clean_artists,
+                                            {prev_week: dataset[prev_week]} if prev_week in dataset else {},
+                                            spotify_client,
+                                            prev_week=prev_week,
+                                            debug=debug,
+                                            record_misses_list=record_misses_list,
+                                            day_of_the_week=day_of_the_week,
+                                            query_cache=query_cache,
+                                            match_index=match_index,
+                                            date=date)
+            if compact:
+                dataset[date] = [ChartEntry(title, artist, query, uri)
+                                 for title, artist, query, uri in zip(titles, artists, queries, uris)]
+            else:
+                dataset[date] = [{'title': title,
+                                  'artist': artist,
+                                  'query': query,
+                                  'uri': uri}
+                                  for title, artist, query, uri in zip(titles, artists, queries, uris)]
+            if index is not None:
+                index.add_week(date, dataset[date])
+            if debug:
+                print(f'Finished Date {i} ({date}) of {len(dates)}')
+            completed.append(date)
+            if checkpoint_path and len(completed) % checkpoint_every == 0:
+                _save_checkpoint(checkpoint_path, dataset, completed, record_misses_list, query_cache)
+    finally:
+        if checkpoint_path:
+            _save_checkpoint(checkpoint_path, dataset, completed, record_misses_list, query_cache)
+
+    return dataset
+
+
+def build_dataset_deduped(start_date: datetime.date,
+                          end_date: datetime.date,
+                          spotify_client: spotipy.Spotify,
+                          http_session: requests.Session,
+                          historical_data: dict = None,
+                          refresh: bool = True,
+                          debug: bool = False,
+                          record_misses_list: list = None,
+                          top_k: int = 50,
+                          day_of_the_week: int = 2,
+                          max_workers: int = 1,
+                          search_workers: int = 1,
+                          query_cache: QueryCache = None,
+                          index: DatasetIndex = None,
+                          page_cache: ChartPageCache = None,
+                          match_index: TrackMatchIndex = None,
+                          extractor: ChartPageExtractor = None) -> dict:
+    """Builds a dataset of weekly Billboard charts in two phases.  First
+       every week's chart is fetched and cleaned, and the queries of the
+       whole range are deduplicated.  Then each distinct query is
+       resolved once and the uris are fanned back out to the weeks.  A
+       song usually charts for many weeks, so this sends one Spotify
+       search per distinct song instead of one per week it is new in.
+       The result is the same as build_dataset's with a query_cache.
+
+    Args:
+        start_date (datetime.date): Indicates the starting week for the
+            dataset (inclusive).
+        start_date (datetime.date): Indicates the ending week for the
+            dataset (inclusive).
+        spotify_client (spotipy.Spotify): A Spotify client session used for
+            accessing Spotify's Web API.
+        http_session (requests.Session): The HTTP session used to send GET
+            requests to Billboard.
+        historical_data: A dict with the same form as that returned by
+            build_dataset.  The week before start_date is used to resolve
+            queries without searching.  Defaults to None, which starts a
+            new ValidatedDataset.
+        refresh (bool): If True, indicates that historical_data should be
+            updated.  Defaults to True.
+        debug (bool): If True, prints missed queries and progress.
+            Defaults to False.
+        record_misses_list (list): A list where the query misses are
+            recorded, each with the best rank its song reached in the
+            range and the first week it charted. Defaults to None.
+        top_k (int): Each week in the dataset will have the top_k of the
+            Billboard Hot 100. Defaults to 50.
+        day_of_the_week (int): Indicates the Python day of the week
+            (Ex. 0 is Monday, 1 is Tuesday, ..., 6 is Sunday). Defaults
+            to 2 (Wednesday).
+        max_workers (int): The maximum number of Billboard pages
+            downloaded at once. Defaults to 1.
+        search_workers (int): The maximum number of Spotify searches sent
+            at once.  Queries are started in priority order: those
+            charting the most weeks first, then by best rank.
+            Defaults to 1.
+        query_cache (QueryCache): A cache of query/uri pairs shared across
+            runs.  Cached queries aren't searched, and the cache is saved
+            once every query is resolved if it has a path.  Defaults to
+            None.
+        index (DatasetIndex): An index of historical_data that is updated
+            as each week is stored. Defaults to None.
+        page_cache (ChartPageCache): A cache of chart pages, so settled
+            weeks are never downloaded twice. Defaults to None.
+        match_index (TrackMatchIndex): An index of known tracks that is
+            checked before searching Spotify. Defaults to None.
+        extractor (ChartPageExtractor): The extractor matching the chart
+            pages' markup. Defaults to None, which uses
+            CHART_PAGE_EXTRACTOR.
+
+    Returns:
+        dict: The same dict returned by build_dataset.
+
+    Raises:
+        InvalidInputException: If historical_data is given in an invalid
+            format, or if start_date and/or end_date are invalid.
+    """
+    dataset = historical_data if historical_data is not None else ValidatedDataset()
+    # Historical data must be a valid dataset that built weeks can be added to
+    if len(dataset) > 0 and not valid_dataset(dataset):
+        print('Historical data must be a valid dataset')
+        raise InvalidInputException
+    if not isinstance(dataset, collections.abc.MutableMapping):
+        print('Historical data must be mutable (Ex. ColumnarDataset.to_dict())')
+        raise InvalidInputException
+
+    dates = _get_week_dates(start_date,
+                            end_date,
+                            dataset,
+                            refresh=refresh,
+                            day_of_the_week=day_of_the_week)
+    if not dates:
+        return dataset
+
+    # Phase 1: collect every week's names, re-using stored weeks if refreshing
+    reused_dates = {date for date in dates
+                    if refresh and date in dataset and top_k <= len(dataset[date])}
+    track_infos = _iter_track_info(session=http_session,
+                                   dates=[date for date in dates if date not in reused_dates],
+                                   upper_bound=top_k,
+                                   max_workers=max_workers,
+                                   page_cache=page_cache,
+                                   extractor=extractor)
+    names = {}
+    for date in dates:
+        if date in reused_dates:
+            names[date] = [(item['title'], item['artist']) for item in dataset[date]]
+        else:
+            names[date] = list(zip(*next(track_infos)))
+    all_titles = [title for date in dates for title, _ in names[date]]
+    all_artists = [artist for date in dates for _, artist in names[date]]
+    with METRICS.timer('clean_seconds'):
+        clean_titles, clean_artists = NAME_NORMALIZER.clean(all_titles, all_artists)
+    queries = ['track:' + title + ' artist:' + artist
+               for title, artist in zip(clean_titles, clean_artists)]
+
+    # Dedupe to one (title, artist) per query, keeping each one's weeks,
+    # best rank and first week
+    unique = {}
+    position = 0
+    for date in dates:
+        for rank in range(len(names[date])):
+            query = queries[position]
+            if query not in unique:
+                unique[query] = {'title': clean_titles[position],
+                                 'artist': clean_artists[position],
+                                 'weeks': 0,
+                                 'rank': rank,
+                                 'date': date}
+            unique[query]['weeks'] += 1
+            unique[query]['rank'] = min(unique[query]['rank'], rank)
+            position += 1
+
+    # Phase 2: resolve each distinct query once
+    prev_week = str(datetime.date.fromisoformat(dates[0]) - datetime.timedelta(weeks=1))
+    prev_queries = {item['query']: item['uri'] for item in dataset.get(prev_week, [])}
+    resolved = {}
+    to_search = []
+    for query, song in unique.items():
+        # As in _get_track_uris, a cached miss doesn't hide a previous week's uri
+        cached = query_cache is not None and query in query_cache
+        if cached and query_cache[query] is not None:
+            METRICS.increment('track_uri_lookups_total', source='query_cache')
+            resolved[query] = query_cache[query]
+        elif query in prev_queries:
+            METRICS.increment('track_uri_lookups_total', source='prev_week')
+            resolved[query] = prev_queries[query]
+        elif cached:
+            METRICS.increment('track_uri_lookups_total', source='query_cache')
+            resolved[query] = None
+        else:
+            to_search.append(query)
+    METRICS.increment('track_uri_lookups_total', position - len(unique), source='deduped')
+    to_search.sort(key=lambda query: (-unique[query]['weeks'], unique[query]['rank']))
+    if debug:
+        print(f'{position} queries, {len(unique)} distinct, {len(to_search)} to search')
+
+    def search(query):
+        if match_index is not None:
+            uri = match_index.match(unique[query]['title'], unique[query]['artist'])
+            if uri is not None:
+                METRICS.increment('track_uri_lookups_total', source='match_index')
+                return uri
+        return _search_track_uri(unique[query]['title'], unique[query]['artist'], spotify_client)
+
+    with ThreadPoolExecutor(max_workers=search_workers) as executor:
+        for query, uri in zip(to_search, executor.map(search, to_search)):
+            resolved[query] = uri
+            if uri is None:
+                _record_miss(unique[query]['rank'], query, record_misses_list, day_of_the_week,
+                             week=unique[query]['date'])
+                if debug:
+                    print(unique[query]['rank'], query)
+    if query_cache is not None:
+        for query, uri in resolved.items():
+            query_cache[query] = uri
+        if query_cache.path:
+            query_cache.save()
+
+    # Fan the uris back out to each week
+    position = 0
+    for i, date in enumerate(dates, 1):
+        dataset[date] = [{'title': title,
+                          'artist': artist,
+                          'query': queries[position + rank],
+                          'uri': resolved[queries[position + rank]]}
+                         for rank, (title, artist) in enumerate(names[date])]
+        position += len(names[date])
+        if index is not None:
+            index.add_week(date, dataset[date])
+        if debug:
+            print(f'Finished Date {i} ({date}) of {len(dates)}')
+
+    return dataset
+
+
+def build_dataset_sharded(start_date: datetime.date,
+                          end_date: datetime.date,
+                          historical_data: dict = None,
+                          refresh: bool = True,
+                          record_misses_list: list = None,
+                          top_k: int = 50,
+                          day_of_the_week: int = 2,
+                          max_workers: int = 1,
+                          query_cache: QueryCache = None,
+                          index: DatasetIndex = None,
+                          shards: int = None,
+                          processes: int = None,
+                          rates: dict = None,
+                          http_session_factory=None,
+                          spotify_client_factory=None,
+                          page_cache: ChartPageCache = None,
+                          extractor: ChartPageExtractor = None) -> dict:
+    """Builds a dataset of weekly Billboard charts by splitting the weeks
+       into contiguous shards that are built with build_dataset in
+       separate processes, so page parsing and name cleaning use every
+       core.  The shards are merged back in date order.
+
+       Each shard's first week has no previous week of its own, so the
+       queries of the week before it are copied into the shard's query
+       cache from historical_data (when refreshing, that's the old build
+       of the same week).  When that week isn't in historical_data, the
+       shard's first week is built beforehand in this process instead
+       and its queries are given to every shard, so the tracks charting
+       across a shard boundary are searched once rather than by both
+       shards.  That adds up to shards - 1 weeks built one at a time
+       before the shards start.
+
+    Args:
+        start_date (datetime.date): Indicates the starting week for the
+            dataset (inclusive).
+        start_date (datetime.date): Indicates the ending week for the
+            dataset (inclusive).
+        historical_data: A dict with the same form as that returned by
+            build_dataset. Defaults to None, which starts a new
+            ValidatedDataset.
+        refresh (bool): If True, indicates that historical_data should be
+            updated.  Defaults to True.
+        record_misses_list (list): A list where the query misses of every
+            shard are recorded. Defaults to None.
+        top_k (int): Each week in the dataset will have the top_k of the
+            Billboard Hot 100. Defaults to 50.
+        day_of_the_week (int): Indicates the Python day of the week
+            (Ex. 0 is Monday, 1 is Tuesday, ..., 6 is Sunday). Defaults
+            to 2 (Wednesday).
+        max_workers (int): The maximum number of Billboard pages each
+            shard downloads at once. Defaults to 1.
+        query_cache (QueryCache): A cache of query/uri pairs.  Each shard
+            starts from a copy of it, and the new entries of every shard
+            are merged back into it.  It is saved afterwards if it has a
+            path. Defaults to None.
+        index (DatasetIndex): An index of historical_data that is updated
+            with every built week. Defaults to None.
+        shards (int): The number of contiguous shards the weeks are split
+            into. Defaults to None, which uses one per process.
+        processes (int): The maximum number of shards built at once.
+            Defaults to None, which uses one per CPU.
+        rates (dict): Requests per second allowed to Billboard
+            ('www.billboard.com') and Spotify ('api.spotify.com') by all
+            shards together.  The default factories split them evenly
+            between the shards built at once. Defaults to None, which
+            uses DEFAULT_RATES.
+        http_session_factory (callable): Called with no args in each
+            shard's process to make its Billboard HTTP session.  It must
+            be picklable (Ex. a module-level function or a
+            functools.partial of one), and each shard has its own rate
+            limits, so lower them accordingly.  Defaults to None, which
+            uses create_http_session with RETRY_STRATEGY and the shard's
+            share of the Billboard rate.
+        spotify_client_factory (callable): Called with no args in each
+            shard's process to make its Spotify client.  The same rules
+            apply.  Defaults to None, which uses create_spotify_client
+            with the shard's share of the Spotify rate.
+        page_cache (ChartPageCache): A cache of chart pages shared by
+            every shard. Defaults to None.
+        extractor (ChartPageExtractor): The extractor matching the chart
+            pages' markup, copied to each shard's process. Defaults to
+            None, which uses CHART_PAGE_EXTRACTOR.
 
-        uris.append(uri)
+    Returns:
+        dict: The same dict returned by build_dataset.
 
-    return queries, uris
+    Raises:
+        InvalidInputException: If historical_data is given in an invalid
+            format, if start_date and/or end_date are invalid, or if a
+            factory isn't a picklable callable.
+    """
+    dataset = historical_data if historical_data is not None else ValidatedDataset()
+    # Historical data must be a valid dataset that built weeks can be added to
+    if len(dataset) > 0 and not valid_dataset(dataset):
+        print('Historical data must be a valid dataset')
+        raise InvalidInputException
+    if not isinstance(dataset, collections.abc.MutableMapping):
+        print('Historical data must be mutable (Ex. ColumnarDataset.to_dict())')
+        raise InvalidInputException
 
+    dates = _get_week_dates(start_date,
+                            end_date,
+                            dataset,
+                            refresh=refresh,
+                            day_of_the_week=day_of_the_week)
+    if not dates:
+        return dataset
+    processes = processes or os.cpu_count()
+    shards = max(1, min(shards or processes, len(dates)))
+
+    # By default, the shards built at once share each host's rate
+    rates = {**DEFAULT_RATES, **(rates or {})}
+    running = min(processes, shards)
+    if http_session_factory is None:
+        http_session_factory = functools.partial(create_http_session,
+                                                 retry_strategy=RETRY_STRATEGY,
+                                                 max_requests_per_second=rates['www.billboard.com'] / running)
+    if spotify_client_factory is None:
+        spotify_client_factory = functools.partial(create_spotify_client,
+                                                   max_requests_per_second=rates['api.spotify.com'] / running)
+
+    # Factories are sent to the worker processes, so check them before any shard starts
+    for factory in (http_session_factory, spotify_client_factory):
+        if not callable(factory):
+            print(f'Factory {factory!r} must be callable')
+            raise InvalidInputException
+        try:
+            pickle.dumps(factory)
+        except (pickle.PicklingError, TypeError, AttributeError) as error:
+            print(f'Factory {factory!r} must be picklable to reach the shard processes: {error}')
+            raise InvalidInputException
+
+    # Split the weeks into contiguous, nearly equal shards
+    size, extra = divmod(len(dates), shards)
+    shard_dates_list = []
+    start = 0
+    for shard in range(shards):
+        shard_dates_list.append(dates[start:start + size + (shard < extra)])
+        start += len(shard_dates_list[-1])
+
+    # Build the boundary weeks here, so the shards on both sides share their queries
+    recorded_misses = {item[-1] for item in record_misses_list or []}
+    shared_cache = query_cache if query_cache is not None else QueryCache()
+    boundary_dates = []
+    for shard_dates in shard_dates_list[1:]:
+        prev_week = str(datetime.date.fromisoformat(shard_dates[0]) - datetime.timedelta(weeks=1))
+        if prev_week not in dataset:
+            boundary_dates.append(shard_dates.pop(0))
+    if boundary_dates:
+        http_session = http_session_factory()
+        spotify_client = spotify_client_factory()
+        misses = []
+        for date in boundary_dates:
+            week = datetime.date.fromisoformat(date)
+            build_dataset(week,
+                          week,
+                          spotify_client,
+                          http_session,
+                          historical_data=dataset,
+                          refresh=refresh,
+                          record_misses_list=misses,
+                          top_k=top_k,
+                          day_of_the_week=day_of_the_week,
+                          query_cache=shared_cache,
+                          index=index,
+                          page_cache=page_cache,
+                          extractor=extractor)
+        if record_misses_list is not None:
+            for miss in misses:
+                if miss[-1] not in recorded_misses:
+                    recorded_misses.add(miss[-1])
+                    record_misses_list.append(miss)
+
+    jobs = []
+    for shard_dates in filter(None, shard_dates_list):
+        prev_week = str(datetime.date.fromisoformat(shard_dates[0]) - datetime.timedelta(weeks=1))
+        jobs.append({'dates': shard_dates,
+                     'historical_data': {date: dataset[date] for date in shard_dates if date in dataset},
+                     'seed_week': {prev_week: dataset[prev_week]} if prev_week in dataset else {},
+                     'refresh': refresh,
+                     'top_k': top_k,
+                     'day_of_the_week': day_of_the_week,
+                     'max_workers': max_workers,
+                     'query_cache': shared_cache,
+                     'http_session_factory': http_session_factory,
+                     'spotify_client_factory': spotify_client_factory,
+                     'page_cache': page_cache,
+                     'extractor': extractor})
+
+    # Merge the shards back in date order
+    with ProcessPoolExecutor(max_workers=running) as executor:
+        for job, result in zip(jobs, executor.map(_build_shard, jobs)):
+            for date in job['dates']:
+                dataset[date] = result['dataset'][date]
+                if index is not None:
+                    index.add_week(date, dataset[date])
+            if record_misses_list is not None:
+                for miss in result['misses']:
+                    if miss[-1] not in recorded_misses:
+                        recorded_misses.add(miss[-1])
+                        record_misses_list.append(miss)
+            if query_cache is not None:
+                query_cache.merge(result['query_cache'])
+            METRICS.merge(result['metrics'])
+    if query_cache is not None and query_cache.path:
+        query_cache.save()
 
-def build_dataset(start_date: datetime.date,
-                  end_date: datetime.date,
-                  spotify_client: spotipy.Spotify,
-                  http_session: requests.Session,
-                  historical_data: dict = None,
-                  refresh: bool = True,
-                  debug: bool = False,
-                  record_misses_list: list = None,
-                  top_k: int = 50,
-                  day_of_the_week: int = 2) -> dict:
-    """Builds a dataset of weekly Billboard charts.
+    return dataset
+
+
+def _build_shard(job: dict) -> dict:
+    """Builds one shard of build_dataset_sharded in a worker process."""
+    # Forked workers inherit the parent's metrics, so start from zero
+    METRICS.reset()
+    query_cache = job['query_cache'] or QueryCache()
+    query_cache.update_from_dataset(job['seed_week'])
+    misses = []
+    dataset = build_dataset(job['dates'][0],
+                            job['dates'][-1],
+                            job['spotify_client_factory'](),
+                            job['http_session_factory'](),
+                            historical_data=ValidatedDataset(job['historical_data']),
+                            refresh=job['refresh'],
+                            record_misses_list=misses,
+                            top_k=job['top_k'],
+                            day_of_the_week=job['day_of_the_week'],
+                            max_workers=job['max_workers'],
+                            query_cache=query_cache,
+                            page_cache=job['page_cache'],
+                            extractor=job['extractor'])
+    return {'dataset': dict(dataset),
+            'misses': misses,
+            'query_cache': query_cache,
+            'metrics': METRICS.to_dict()}
+
+
+async def build_dataset_async(start_date: datetime.date,
+                              end_date: datetime.date,
+                              spotify_client: spotipy.Spotify,
+                              http_session: requests.Session,
+                              historical_data: dict = None,
+                              refresh: bool = True,
+                              debug: bool = False,
+                              record_misses_list: list = None,
+                              top_k: int = 50,
+                              day_of_the_week: int = 2,
+                              max_workers: int = 4,
+                              queue_size: int = 8,
+                              query_cache: QueryCache = None,
+                              index: DatasetIndex = None,
+                              page_cache: ChartPageCache = None,
+                              match_index: TrackMatchIndex = None,
+                              extractor: ChartPageExtractor = None) -> dict:
+    """Builds a dataset of weekly Billboard charts with an asyncio pipeline.
+       Fetching, parsing, cleaning, searching and storing run as separate
+       stages joined by bounded queues, so downloading later weeks
+       overlaps with searching earlier ones.  Blocking requests and
+       spotipy calls run in a thread pool.
 
     Args:
         start_date (datetime.date): Indicates the starting week for the
             dataset (inclusive).
-        start_date (datetime.date): Indicates the ending week for the
+        end_date (datetime.date): Indicates the ending week for the
             dataset (inclusive).
         spotify_client (spotipy.Spotify): A Spotify client session used for
             accessing Spotify's Web API.
         http_session (requests.Session): The HTTP session used to send GET
             requests to Billboard.
         historical_data: A dict with the same form as that returned by
-            build_dataset.  It is used as a cache where the previous week's
-            data is used if possible to prevent unnecessary expensive
-            queries to Spotify.  Defaults to None.
+            build_dataset.  Defaults to None.
         refresh (bool): If True, indicates that historical_data should be
             updated.  Defaults to True.
         debug (bool): If True, prints missed queries and finished dates.
             Defaults to False.
-        record_misses_list (list): A list where the query misses are
-            recorded. Defaults to None.
+        record_misses_list (list): A list (or MissStore) where the query
+            misses are recorded. Defaults to None.
         top_k (int): Each week in the dataset will have the top_k of the
             Billboard Hot 100. Defaults to 50.
         day_of_the_week (int): Indicates the Python day of the week
             (Ex. 0 is Monday, 1 is Tuesday, ..., 6 is Sunday). Defaults
             to 2 (Wednesday).
+        max_workers (int): The number of threads running blocking
+            network and parsing calls. Defaults to 4.
+        queue_size (int): The maximum number of weeks waiting between
+            any two stages.  A full queue pauses the stage feeding it,
+            which bounds both memory and the number of pages in flight.
+            Defaults to 8.
+        query_cache (QueryCache): A cache of query/uri pairs shared across
+            weeks and runs. Defaults to None.
+        index (DatasetIndex): An index of historical_data that is updated
+            as each week is stored. Defaults to None.
+        page_cache (ChartPageCache): A cache of chart pages. Defaults to
+            None.
+        match_index (TrackMatchIndex): An index of known tracks that is
+            checked before searching Spotify. Defaults to None.
+        extractor (ChartPageExtractor): The extractor matching the chart
+            pages' markup. Defaults to None, which uses
+            CHART_PAGE_EXTRACTOR.
 
     Returns:
-        dict: Keys are ISO dates (YYYY-MM-DD) indicating the week of the
-            chart and values are dicts of the form: {'title': title,
-                                                     'artist': artist,
-                                                     'query': query,
-                                                     'uri': uri} .
+        dict: The same dict returned by build_dataset.
 
     Raises:
         InvalidInputException: If historical_data is given in an invalid
             format, or if start_date and/or end_date are invalid.
     """
-    dataset = historical_data if historical_data is not None else {}
-    # Historical data must be a valid dataset
+    dataset = historical_data if historical_data is not None else ValidatedDataset()
+    # Historical data must be a valid dataset that built weeks can be added to
     if len(dataset) > 0 and not valid_dataset(dataset):
         print('Historical data must be a valid dataset')
         raise InvalidInputException
-
-    # Convert dates to datetime.date objects
-    try:
-        if not isinstance(start_date, datetime.date):
-            start_date = datetime.date.fromisoformat(start_date)
-        if not isinstance(end_date, datetime.date):
-            end_date = datetime.date.fromisoformat(end_date)
-    except ValueError:
-        print('Invalid start or end dates')
-        raise InvalidInputException
-
-    # Either extend or refresh the historical data
-    if len(dataset) > 0:
-        index = 0 if refresh else -1
-        first_week = datetime.date.fromisoformat(list(dataset)[index])
-        if refresh and first_week < start_date:
-            start_date = first_week
-    
-    # Verify that dates are valid and restrict them to reasonable values
-    if (start_date > end_date):
-        print("Start date must be on or before end date...")
+    if not isinstance(dataset, collections.abc.MutableMapping):
+        print('Historical data must be mutable (Ex. ColumnarDataset.to_dict())')
         raise InvalidInputException
-    if (start_date < datetime.date(1960, 1, 1)):
-        start_date = datetime.date(1960, 1, 1)
-    if (end_date > datetime.date.today()):
-        end_date = datetime.date.today()
-    
-    # Center weeks on provided day of the week
-    if day_of_the_week:
-        if end_date.weekday() != day_of_the_week:
-            end_date += datetime.timedelta(days=day_of_the_week - end_date.weekday())
-        if start_date.weekday() != day_of_the_week:
-            start_date += datetime.timedelta(days=day_of_the_week - start_date.weekday())
-    
-    # Find all dates b/w start and end
-    week = datetime.timedelta(weeks=1)
-    dates = [str(start_date)]
-    while start_date <= end_date:
-        start_date += week
-        if start_date > end_date:
-            break
-        dates.append(str(start_date))
 
-    # Build the date dict and return it
-    for i, date in enumerate(dates, 1):
-        # If refreshing, re-use titles and artists to prevent http GET request
-        if refresh and date in dataset and top_k <= len(dataset[date]):
-            titles, artists = zip(*[(item['title'], item['artist']) for item in dataset[date]])
-        else:
-            titles, artists = _get_track_info(session=http_session,
-                                              date=date,
-                                              upper_bound=top_k)
-        
-        # Reformat title and artist strings to be compatible with Spotify API search
-        clean_titles = [_clean_title_name(name) for name in titles]
-        clean_artists = [_clean_artist_name(name) for name in artists]
-        prev_week = str(datetime.date.fromisoformat(date) - week) if i > 1 else None
-        queries, uris = _get_track_uris(clean_titles,
-                                        clean_artists,
-                                        dataset,
-                                        spotify_client,
-                                        prev_week=prev_week,
-                                        debug=debug,
-                                        record_misses_list=record_misses_list,
-                                        day_of_the_week=day_of_the_week)
-        dataset[date] = [{'title': title,
-                          'artist': artist,
-                          'query': query,
-                          'uri': uri} 
-                          for title, artist, query, uri in zip(titles, artists, queries, uris)]
-        if debug:
-            print(f'Finished Date {i} ({date}) of {len(dates)}')
+    dates = _get_week_dates(start_date,
+                            end_date,
+                            dataset,
+                            refresh=refresh,
+                            day_of_the_week=day_of_the_week)
+    reused_dates = {date for date in dates
+                    if refresh and date in dataset and top_k <= len(dataset[date])}
+
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def run_blocking(func, *args, **kwargs):
+        return loop.run_in_executor(executor, functools.partial(func, *args, **kwargs))
+
+    pages = asyncio.Queue(maxsize=queue_size)
+    names = asyncio.Queue(maxsize=queue_size)
+    clean_names = asyncio.Queue(maxsize=queue_size)
+    rankings = asyncio.Queue(maxsize=queue_size)
+
+    async def fetch():
+        # Downloads start here; parse awaits them in date order
+        for date in dates:
+            page = None if date in reused_dates else run_blocking(_fetch_chart_page,
+                                                                     http_session,
+                                                                     date,
+                                                                     page_cache=page_cache,
+                                                                     extractor=extractor)
+            await pages.put((date, page))
+        await pages.put(None)
+
+    async def parse():
+        while (job := await pages.get()) is not None:
+            date, page = job
+            if page is None:
+                titles, artists = zip(*[(item['title'], item['artist']) for item in dataset[date]])
+            else:
+                titles, artists = await run_blocking(_parse_chart_page, await page, 0, top_k, extractor)
+            await names.put((date, titles, artists))
+        await names.put(None)
+
+    async def clean():
+        while (job := await names.get()) is not None:
+            date, titles, artists = job
+            # Reformat title and artist strings to be compatible with Spotify API search
+            with METRICS.timer('clean_seconds'):
+                clean_titles, clean_artists = NAME_NORMALIZER.clean(titles, artists)
+            await clean_names.put((date, titles, artists, clean_titles, clean_artists))
+        await clean_names.put(None)
+
+    async def search():
+        # Only the previous week is handed to _get_track_uris, since the
+        # store stage may not have caught up with it yet
+        prev_week = None
+        while (job := await clean_names.get()) is not None:
+            date, titles, artists, clean_titles, clean_artists = job
+            queries, uris = await run_blocking(_get_track_uris,
+                                               clean_titles,
+                                               clean_artists,
+                                               dict([prev_week]) if prev_week else {},
+                                               spotify_client,
+                                               prev_week=prev_week[0] if prev_week else None,
+                                               debug=debug,
+                                               record_misses_list=record_misses_list,
+                                               day_of_the_week=day_of_the_week,
+                                               query_cache=query_cache,
+                                               match_index=match_index,
+                                               date=date)
+            ranking = [{'title': title,
+                        'artist': artist,
+                        'query': query,
+                        'uri': uri}
+                       for title, artist, query, uri in zip(titles, artists, queries, uris)]
+            prev_week = (date, ranking)
+            await rankings.put((date, ranking))
+        await rankings.put(None)
+
+    async def store():
+        i = 0
+        while (job := await rankings.get()) is not None:
+            date, ranking = job
+            dataset[date] = ranking
+            if index is not None:
+                index.add_week(date, ranking)
+            i += 1
+            if debug:
+                print(f'Finished Date {i} ({date}) of {len(dates)}')
+
+    # A failed stage cancels the rest so none is left blocked on a queue
+    tasks = [asyncio.ensure_future(stage()) for stage in (fetch, parse, clean, search, store)]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        executor.shutdown(wait=False)
 
     return dataset
 
-def get_mongo_dataset(dataset: dict) -> list:
+
+def get_mongo_dataset(dataset: dict,
+                      spotify_info_dict: dict = None) -> list:
     """Preps a dataset of weekly Billboard charts for MongoDB upload.
 
     Args:
         dataset (dict): A dict with the same form as that returned by
             build_dataset.
+        spotify_info_dict (dict): A dict with the same form as that
+            returned by get_spotify_info.  If given, each ranking item is
+            replaced by the slimmed Spotify info the frontend reads (see
+            get_chart_projection), so a single read serves a whole
+            chart. Defaults to None.
 
     Returns:
         list: A list of dicts for each week in dataset. Keys of each
@@ -380,18 +2890,83 @@ def get_mongo_dataset(dataset: dict) -> list:
              required to have a unique '_id' field.
 
     Raises:
-        InvalidInputException: If dataset is given in an invalid
-            format.
+        InvalidInputException: If dataset or spotify_info_dict is given
+            in an invalid format.
     """
     # Dataset must be valid
     if not valid_dataset(dataset):
         raise InvalidInputException
 
+    # Spotify info must be valid
+    if spotify_info_dict is not None and not valid_spotify_info(spotify_info_dict):
+        raise InvalidInputException
+
+    return list(_iter_mongo_dataset(dataset, spotify_info_dict))
+
+
+def _iter_mongo_dataset(dataset: dict, spotify_info_dict: dict = None):
+    """Yields the documents of get_mongo_dataset one week at a time,
+       without validating its inputs."""
     # Less direct access to uris, but compatible with mongodb
-    return [{'_id': date,
-             'ranking': dataset[date]}
-             for date
-             in dataset]
+    if spotify_info_dict is None:
+        for date in dataset:
+            yield {'_id': date,
+                   'ranking': [item.to_dict() if isinstance(item, ChartEntry) else item
+                               for item in dataset[date]]}
+        return
+
+    # Project each uri once and share the result across all weeks
+    projections = {}
+    for date in dataset:
+        ranking = []
+        for item in dataset[date]:
+            uri = item['uri']
+            if uri not in spotify_info_dict:
+                ranking.append(_get_missing_chart_projection(item))
+                continue
+            if uri not in projections:
+                projections[uri] = get_chart_projection(spotify_info_dict[uri])
+            ranking.append(projections[uri])
+        yield {'_id': date,
+               'ranking': ranking}
+
+
+def get_chart_projection(spotify_info: dict) -> dict:
+    """Slims one uri's Spotify info down to the fields the frontend
+       reads: track name, artist names, album image urls, uri and
+       genres.  The nesting of get_spotify_info's output is kept, so
+       the frontend can read it the same way.
+
+    Args:
+        spotify_info (dict): One value of the dict returned by
+            get_spotify_info.
+
+    Returns:
+        dict: A dict of the form:
+            {'track_info': {'uri': uri,
+                            'name': name,
+                            'artists': [{'name': name}, ...],
+                            'album': {'images': [{'url': url}, ...]}},
+             'artist_info': {'genres': genres}} .
+    """
+    track_info = spotify_info['track_info']
+    artist_info = spotify_info.get('artist_info') or {}
+    return {'track_info': {'uri': track_info['uri'],
+                           'name': track_info['name'],
+                           'artists': [{'name': artist['name']}
+                                       for artist in track_info['artists']],
+                           'album': {'images': [{'url': image['url']}
+                                                for image in track_info['album']['images']]}},
+            'artist_info': {'genres': artist_info.get('genres', [])}}
+
+
+def _get_missing_chart_projection(item: dict) -> dict:
+    """Returns the placeholder the frontend shows for an item without
+       Spotify info."""
+    return {'trackName': item['title'],
+            'trackArtist': item['artist'],
+            'track_info': {'uri': None},
+            'artist_info': {'genres': 'N/A'}}
 
 
 def get_mongo_spotify_info(spotify_info_dict: dict) -> list:
@@ -423,11 +2998,83 @@ def get_mongo_spotify_info(spotify_info_dict: dict) -> list:
             for uri in spotify_info_dict]
 
 
+def _get_json_file_path(path: str,
+                        file_string: str,
+                        ndjson: bool = False,
+                        compression: str = None) -> str:
+    """Returns a versioned, not yet existing file path in path for
+       file_string, with an extension matching the output format."""
+    if compression not in JSON_COMPRESSION_SUFFIXES:
+        print(f'Compression must be one of {list(JSON_COMPRESSION_SUFFIXES)}')
+        raise InvalidInputException
+
+    # Version the file to prevent overwriting
+    file_version = len(glob.glob(os.path.join(glob.escape(path), glob.escape(file_string)) + '_v*'))
+    extension = '.ndjson' if ndjson else '.json'
+    return os.path.join(path, f'{file_string}_v{file_version}{extension}'
+                              f'{JSON_COMPRESSION_SUFFIXES[compression]}')
+
+
+def _open_json_file(file_path: str, mode: str = 'r'):
+    """Opens a text stream on file_path, (de)compressing it according to
+       its extension."""
+    if file_path.endswith('.gz'):
+        return gzip.open(file_path, mode + 't', encoding='utf-8')
+    if file_path.endswith('.zst'):
+        # Optional dependency, only needed for zstd files
+        import zstandard
+        raw = open(file_path, mode + 'b')
+        if mode == 'w':
+            stream = zstandard.ZstdCompressor().stream_writer(raw)
+        else:
+            stream = zstandard.ZstdDecompressor().stream_reader(raw)
+        return io.TextIOWrapper(stream, encoding='utf-8')
+    return open(file_path, mode, encoding='utf-8')
+
+
+def _write_json_stream(f,
+                       records,
+                       as_list: bool = False,
+                       ndjson: bool = False,
+                       indent: int = None) -> None:
+    """Writes records to f one at a time.  records yields (key, value)
+       pairs for a JSON object, or documents if as_list or ndjson.
+       Without indent, each record is written on its own line so that
+       iter_json_file can read it back one record at a time."""
+    if ndjson:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False, default=_to_json) + '\n')
+        return
+
+    f.write('[' if as_list else '{')
+    for i, record in enumerate(records):
+        f.write(',\n' if i else '\n')
+        if as_list:
+            f.write(json.dumps(record, ensure_ascii=False, indent=indent, default=_to_json))
+        else:
+            key, value = record
+            f.write(json.dumps(key, ensure_ascii=False) + ': ' +
+                    json.dumps(value, ensure_ascii=False, indent=indent, default=_to_json))
+    f.write('\n]' if as_list else '\n}')
+
+
+def _to_json(obj):
+    """Serializes the types json doesn't know about (ChartEntry)."""
+    if isinstance(obj, ChartEntry):
+        return obj.to_dict()
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+
 def save_dataset_as_json(dataset: dict,
                          path: str = os.getcwd(),
                          indent: int = None,
-                         mongodb: bool = False) -> None:
-    """Saves a dataset of weekly Billboard charts as a JSON file.
+                         mongodb: bool = False,
+                         spotify_info_dict: dict = None,
+                         ndjson: bool = False,
+                         compression: str = None) -> str:
+    """Saves a dataset of weekly Billboard charts as a JSON file.  The
+       file is written one week at a time, so memory use doesn't grow
+       with the size of the dataset.
 
     Args:
         dataset (dict): A dict with the same form as that returned by
@@ -440,14 +3087,27 @@ def save_dataset_as_json(dataset: dict,
             to None.
         mongodb (bool): If True, applies get_mongo_dataset to dataset
             before saving. Defaults to False.
+        spotify_info_dict (dict): If given with mongodb=True, it is
+            passed to get_mongo_dataset to save denormalized weekly
+            documents. Defaults to None.
+        ndjson (bool): If True, saves the MongoDB documents one per line
+            (newline-delimited JSON), ready for mongoimport.  Implies
+            mongodb=True. Defaults to False.
+        compression (str): None, 'gzip' or 'zstd' (requires the
+            zstandard package). Defaults to None.
+
+    Returns:
+        str: The path of the saved file, or None if path doesn't exist.
 
     Raises:
         InvalidInputException: If dataset is given in an invalid
-            format.
+            format, or compression is not supported.
     """
     # Dataset must be valid
     if not valid_dataset(dataset):
         raise InvalidInputException
+    if spotify_info_dict is not None and not valid_spotify_info(spotify_info_dict):
+        raise InvalidInputException
 
     # Verify existence of path
     if not os.path.exists(path):
@@ -456,9 +3116,12 @@ def save_dataset_as_json(dataset: dict,
     
     # Format file string
     file_string = 'billboard_uris_ranking'
+    mongodb = mongodb or ndjson
     if mongodb: # mongodb needs to be compact
         indent = None
         file_string += '_mongodb'
+        if spotify_info_dict is not None:
+            file_string += '_denormalized'
     if indent:
         file_string += '_indented'
     
@@ -468,23 +3131,27 @@ def save_dataset_as_json(dataset: dict,
     start_date = dates[0]
     end_date = dates[-1]
     file_string += f'_{start_date}_to_{end_date}_{datetime.date.fromisoformat(start_date).strftime("%a").lower()}'
-
-    # Version the file to prevent overwriting
-    file_version = len(glob.glob(file_string + '*.json'))
-    file_string += f'_v{file_version}.json'
+    file_path = _get_json_file_path(path, file_string, ndjson=ndjson, compression=compression)
     
-    # Save dict as file_string
-    with open(os.path.join(path, file_string), 'w', encoding='utf-8') as f:
-        # Format dict if necessary
-        save_dict = get_mongo_dataset(dataset) if mongodb else dataset
-        json.dump(save_dict, f, ensure_ascii=False, indent=indent)
+    # Save dataset as file_path one week at a time
+    with _open_json_file(file_path, 'w') as f:
+        # Format weeks if necessary
+        records = (_iter_mongo_dataset(dataset, spotify_info_dict) if mongodb
+                   else ((date, dataset[date]) for date in dataset))
+        _write_json_stream(f, records, as_list=mongodb, ndjson=ndjson, indent=indent)
+
+    return file_path
 
 
 def save_spotify_info_as_json(spotify_info_dict: dict,
                               path: str = os.getcwd(),
                               indent: int = None,
-                              mongodb: bool = False) -> None:
-    """Saves a dataset of weekly Billboard charts as a JSON file.
+                              mongodb: bool = False,
+                              ndjson: bool = False,
+                              compression: str = None) -> str:
+    """Saves a dict with Spotify track info as a JSON file.  The file is
+       written one uri at a time, so memory use doesn't grow with the
+       number of uris.
 
     Args:
         spotify_info_dict (dict): A dict with the same form as that
@@ -497,10 +3164,18 @@ def save_spotify_info_as_json(spotify_info_dict: dict,
             to None.
         mongodb (bool): If True, applies get_mongo_spotify_info to
             spotify_info_dict before saving. Defaults to False.
+        ndjson (bool): If True, saves the MongoDB documents one per line
+            (newline-delimited JSON), ready for mongoimport.  Implies
+            mongodb=True. Defaults to False.
+        compression (str): None, 'gzip' or 'zstd' (requires the
+            zstandard package). Defaults to None.
+
+    Returns:
+        str: The path of the saved file, or None if path doesn't exist.
 
     Raises:
         InvalidInputException: If spotify_info_dict is given in an invalid
-            format.
+            format, or compression is not supported.
     """
     # Spotify info must be valid
     if not valid_spotify_info(spotify_info_dict):
@@ -513,26 +3188,127 @@ def save_spotify_info_as_json(spotify_info_dict: dict,
     
     # Format file string
     file_string = 'billboard_uris_spotify_info'
+    mongodb = mongodb or ndjson
     if mongodb: # mongodb needs to be compact
         indent = None
         file_string += '_mongodb'
     if indent:
         file_string += '_indented'
+    file_path = _get_json_file_path(path, file_string, ndjson=ndjson, compression=compression)
     
-    # Version the file to prevent overwriting
-    file_version = len(glob.glob(file_string + '*.json'))
-    file_string += f'_v{file_version}.json'
-    
-    # Save dict as file_string
-    with open(os.path.join(path, file_string), 'w', encoding='utf-8') as f:
-        # Format dict if necessary
-        save_dict = get_mongo_spotify_info(spotify_info_dict) if mongodb else spotify_info_dict
-        json.dump(save_dict, f, ensure_ascii=False, indent=indent)
+    # Save dict as file_path one uri at a time
+    with _open_json_file(file_path, 'w') as f:
+        # Format uris if necessary
+        records = (dict(_id=uri, **spotify_info_dict[uri]) if mongodb
+                   else (uri, spotify_info_dict[uri])
+                   for uri in spotify_info_dict)
+        _write_json_stream(f, records, as_list=mongodb, ndjson=ndjson, indent=indent)
+
+    return file_path
+
+
+def iter_json_file(file_path: str):
+    """Reads a file saved by save_dataset_as_json or
+       save_spotify_info_as_json one record at a time.  The format is
+       detected from the content: records are streamed line by line
+       while each line holds a whole top-level record (NDJSON and
+       unindented files), and as soon as one doesn't (Ex. an indented
+       file), the whole file is read instead, skipping the records
+       already yielded.
+
+    Args:
+        file_path (str): A path string (or path-like object) of the file.
+            Compression is detected from the .gz or .zst extension.
+
+    Yields:
+        tuple: (key, value) pairs.  For plain files these are the
+            date/ranking or uri/info pairs of the saved dict.  For
+            MongoDB files, key is each document's '_id' and value is the
+            rest of the document.
+    """
+    yielded = 0
+    with _open_json_file(file_path) as f:
+        first = True
+        for line in f:
+            record_line = line.strip().rstrip(',')
+            if record_line == '' or record_line in ('}', ']') or (first and record_line in ('{', '[')):
+                continue
+            first = False
+            # Top-level records are never indented, so an indented line
+            # means the records span several lines
+            if line[0].isspace():
+                break
+            try:
+                record = json.loads(record_line if record_line.startswith('{')
+                                    else '{' + record_line + '}')
+            except json.JSONDecodeError:
+                break
+            for pair in _iter_json_records(record):
+                yielded += 1
+                yield pair
+        else:
+            return
+
+    with _open_json_file(file_path) as f:
+        records = json.load(f)
+    yield from itertools.islice(_iter_json_records(records), yielded, None)
+
+
+def _iter_json_records(records):
+    """Yields the (key, value) pairs of a JSON object, a list of MongoDB
+       documents or a single document."""
+    if isinstance(records, list):
+        for record in records:
+            yield from _iter_json_records(record)
+    elif '_id' in records:
+        record = dict(records)
+        key = record.pop('_id')
+        yield key, record
+    else:
+        yield from records.items()
+
+
+def load_dataset_json(file_path: str, compact: bool = False) -> dict:
+    """Loads a dataset saved by save_dataset_as_json, including its
+       MongoDB and NDJSON forms.
+
+    Args:
+        file_path (str): A path string (or path-like object) of the file.
+        compact (bool): If True, items are loaded as ChartEntry objects.
+            Defaults to False.
+
+    Returns:
+        dict: A ValidatedDataset with the same form as the dict returned
+            by build_dataset.
+
+    Raises:
+        InvalidInputException: If the file doesn't hold a valid dataset.
+    """
+    dataset = ValidatedDataset()
+    for date, value in iter_json_file(file_path):
+        ranking = value['ranking'] if isinstance(value, dict) else value
+        dataset[date] = [ChartEntry.from_dict(item) for item in ranking] if compact else ranking
+    return dataset
+
+
+def load_spotify_info_json(file_path: str) -> dict:
+    """Loads Spotify track info saved by save_spotify_info_as_json,
+       including its MongoDB and NDJSON forms.
+
+    Args:
+        file_path (str): A path string (or path-like object) of the file.
+
+    Returns:
+        dict: A dict with the same form as that returned by
+            get_spotify_info.
+    """
+    return dict(iter_json_file(file_path))
         
 
 def manual_add_uri(dataset: dict,
                    uri: str = None,
-                   query: str = None) -> None:
+                   query: str = None,
+                   index: DatasetIndex = None) -> None:
     """Updates dataset by adding uri to dataset at query.
 
     Args:
@@ -544,6 +3320,9 @@ def manual_add_uri(dataset: dict,
         query (str): Spotify query string
             (Ex. "track:Rock With You artist:Michael Jackson") that
             the user would like to update with uri.
+        index (DatasetIndex): An index of dataset.  If given, only the
+            items with query are visited and the index is kept up to
+            date. Defaults to None.
 
     Raises:
         InvalidInputException: If dataset is given in an invalid
@@ -554,14 +3333,20 @@ def manual_add_uri(dataset: dict,
         raise InvalidInputException
     
     # Add the uri corresponding to query
+    if not (uri and query):
+        return
+    if index is not None:
+        index.set_uri(query, uri)
+        return
     for date in dataset:
         for item in dataset[date]:
-            if uri and query and item['query'] == query:
+            if item['query'] == query:
                 item['uri'] = uri
 
                 
 def manual_add_uris(dataset: dict,
-                    uri_dict: dict = None) -> None:
+                    uri_dict: dict = None,
+                    index: DatasetIndex = None) -> None:
     """Updates dataset by adding all uris in uri_dict to dataset.
 
     Args:
@@ -572,6 +3357,9 @@ def manual_add_uris(dataset: dict,
             values are Spotify URI strings
             (Ex. "spotify:track:0SErdEdRcVX1uJCf1eTGYH") that the
             user would like to add to dataset.
+        index (DatasetIndex): An index of dataset, kept up to date with
+            the new uris.  If None, a temporary index is built once for
+            the whole batch. Defaults to None.
 
     Raises:
         InvalidInputException: If dataset is given in an invalid
@@ -582,18 +3370,22 @@ def manual_add_uris(dataset: dict,
         raise InvalidInputException
     
     # Add each uri in the dict to the dataset
+    if index is None:
+        index = DatasetIndex(dataset)
     for query in uri_dict:
-        manual_add_uri(dataset=dataset,
-                       uri=uri_dict[query],
-                       query=query)
+        if uri_dict[query] and query:
+            index.set_uri(query, uri_dict[query])
         
 
-def get_unique_uris(dataset: dict) -> set:
+def get_unique_uris(dataset: dict, index: DatasetIndex = None) -> set:
     """Returns the set of all unique uris in dataset.
 
     Args:
         dataset (dict): A dict with the same form as that returned by
             build_dataset.
+        index (DatasetIndex): An index of dataset.  If given, the uris
+            are read from it instead of scanning dataset. Defaults to
+            None.
 
     Returns:
         set: The set of all unique uris in dataset.
@@ -605,21 +3397,41 @@ def get_unique_uris(dataset: dict) -> set:
     if not valid_dataset(dataset):
         raise InvalidInputException
 
+    if index is not None:
+        return index.uris
     return {item['uri'] for date in dataset for item in dataset[date] if item['uri']}
 
 
+def _chunks(items: list, size: int):
+    """Yields successive slices of items with at most size elements."""
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
 def get_spotify_info(uris: set,
                      artist_info: bool = False,
-                     audio_features: bool = False) -> dict:
-    """Gets Spotify track info associated with uris.
+                     audio_features: bool = False,
+                     spotify_client: spotipy.Spotify = None,
+                     missing_uris: list = None) -> dict:
+    """Gets Spotify track info associated with uris.  Info is fetched
+       through Spotify's multi-ID endpoints: tracks in batches of 50,
+       audio features in batches of 100 and artists in batches of 50.
+       Each artist is fetched once, no matter how many of its tracks
+       are in uris.  Uris Spotify has no track for (Ex. unknown or
+       relinked ids) are left out.
 
     Args:
         uris (set): A set of uris the user would like to get Spotify
             info for.
         artist_info (bool): If True, adds Spotify artist info
             corresponding to uris. Defaults to False.
-        artist_info (bool): If True, adds Spotify audio features
+        audio_features (bool): If True, adds Spotify audio features
             corresponding to uris. Defaults to False.
+        spotify_client (spotipy.Spotify): A Spotify client session used for
+            accessing Spotify's Web API.  Defaults to None, which uses
+            the module-level spotify client.
+        missing_uris (list): A list where the uris left out are
+            recorded. Defaults to None.
 
     Returns: dict: Dict where keys are Spotify URI strings
             (Ex. "spotify:track:0SErdEdRcVX1uJCf1eTGYH") and values
@@ -638,19 +3450,39 @@ def get_spotify_info(uris: set,
     # Verify that uris are valid
     if not valid_uris(uris):
         raise InvalidInputException
-
-   # Build dict
+    if spotify_client is None:
+        spotify_client = spotify
+
+    # Build dict
+    uris = list(uris)
+    spotify_info_dict = {}
+    for batch in _chunks(uris, 50):
+        METRICS.increment('spotify_info_requests_total', endpoint='tracks')
+        for uri, track in zip(batch, spotify_client.tracks(batch)['tracks']):
+            if track is None:
+                METRICS.increment('spotify_info_misses_total')
+                if missing_uris is not None:
+                    missing_uris.append(uri)
+                continue
+            spotify_info_dict[uri] = {'track_info': track}
+    uris = list(spotify_info_dict)
     if audio_features:
-        spotify_info_dict = {uri: {'track_info': spotify.track(uri),
-                                   'audio_features': spotify.audio_features(uri)[0]}
-                                   for uri in uris}
-    else:
-        spotify_info_dict = {uri: {'track_info': spotify.track(uri)}
-                             for uri in uris}  
+        for batch in _chunks(uris, 100):
+            METRICS.increment('spotify_info_requests_total', endpoint='audio_features')
+            for uri, features in zip(batch, spotify_client.audio_features(batch)):
+                spotify_info_dict[uri]['audio_features'] = features
     if artist_info:
+        # Deduplicate artists before fetching them
+        artist_uris = {uri: spotify_info_dict[uri]['track_info']['artists'][0]['uri']
+                       for uri in spotify_info_dict
+                       if spotify_info_dict[uri]['track_info'].get('artists')}
+        artists = {}
+        for batch in _chunks(list(set(artist_uris.values())), 50):
+            METRICS.increment('spotify_info_requests_total', endpoint='artists')
+            for artist_uri, artist in zip(batch, spotify_client.artists(batch)['artists']):
+                artists[artist_uri] = artist
         for uri in spotify_info_dict:
-            artist_uri = spotify_info_dict[uri]['track_info']['artists'][0]['uri']
-            spotify_info_dict[uri]['artist_info'] = spotify.artist(artist_uri)
+            spotify_info_dict[uri]['artist_info'] = artists.get(artist_uris.get(uri))
 
     return spotify_info_dict
     
@@ -659,7 +3491,8 @@ def add_spotify_info_inline(dataset: dict,
                             uris: set = None,
                             spotify_info_dict: dict = None,
                             artist_info: bool = False,
-                            audio_features: bool = False) -> None:
+                            audio_features: bool = False,
+                            spotify_client: spotipy.Spotify = None) -> None:
     """Updates dataset by adding Spotify info directly into dataset.
        WARNING: If storing locally, such datasets are typically quite
            large.
@@ -676,8 +3509,11 @@ def add_spotify_info_inline(dataset: dict,
             Defaults to None.
         artist_info (bool): If True, adds Spotify artist info
             corresponding to uris. Defaults to False.
-        artist_info (bool): If True, adds Spotify audio features
+        audio_features (bool): If True, adds Spotify audio features
             corresponding to uris. Defaults to False.
+        spotify_client (spotipy.Spotify): A Spotify client session used
+            when spotify_info_dict is None. Defaults to None, which uses
+            the module-level spotify client.
     Raises:
         InvalidInputException: If dataset, spotify_info_dict, or uris
             are given in an invalid format.
@@ -694,10 +3530,11 @@ def add_spotify_info_inline(dataset: dict,
     if not spotify_info_dict:
         spotify_info_dict = get_spotify_info(uris,
                                              audio_features=audio_features,
-                                             artist_info=artist_info)
+                                             artist_info=artist_info,
+                                             spotify_client=spotify_client)
     for date in dataset:
         for item in dataset[date]:
-            item['spotify_info'] = spotify_info_dict[item['uri']] if item['uri'] else None
+            item['spotify_info'] = spotify_info_dict.get(item['uri']) if item['uri'] else None
             
 
 def valid_uris(uris: set, uri_type: str = 'track') -> bool:
@@ -743,42 +3580,66 @@ def valid_dataset(dataset: dict) -> bool:
            required keys: 'title', 'artist', 'query', 'uri'.
 
     Args:
-        dataset (dict): A dict with the same form as that returned by
+        dataset (dict): A dict (or read-only mapping, Ex. a
+            ColumnarDataset) with the same form as that returned by
             build_dataset.
 
     Returns:
         bool: True if all items in the dataset are valid, else False.
     """
-    # Dataset must be a dict
-    if not isinstance(dataset, dict):
+    # Dataset must be a dict or a read-only view of one
+    if not isinstance(dataset, collections.abc.Mapping):
         return False
+
+    # Each week was already checked when it was inserted
+    if isinstance(dataset, ValidatedDataset):
+        return True
     
-    for date in dataset:
-        # Keys must be ISO formatted dates (YYYY-MM-DD)
-        try:
-            datetime.date.fromisoformat(date)
-        except ValueError:
-            print(f'Invalid date string {date}')
-            return False
-        # Values must be iterable
-        try:
-            iterator = iter(dataset[date])
-        except TypeError:
-            print(f'Value {dataset[date]} is not iterable')
-            return False
-        # Each item must be a dict with the required keys
-        required_keys = {'title', 'artist', 'query', 'uri'}
-        for item in dataset[date]:
-            if not (isinstance(item, dict) and
-                    all(key in item for key in required_keys)
-            ):
-                print(f'Item {item} is not a dict or does not have all required keys')
-                return False
+    if not all(valid_week(date, dataset[date]) for date in dataset):
+        return False
 
     # Passed all checks; valid dataset
     return True
 
 
+def valid_week(date: str, ranking: list) -> bool:
+    """Checks if a single week of a dataset is valid.  In this case,
+           valid means date must be an ISO formatted date (YYYY-MM-DD),
+           and each item in ranking must be a dict (or ChartEntry) with
+           the following required keys: 'title', 'artist', 'query', 'uri'.
+
+    Args:
+        date (str): The week's key in the dataset.
+        ranking (list): The week's value in the dataset.
+
+    Returns:
+        bool: True if the week is valid, else False.
+    """
+    # Keys must be ISO formatted dates (YYYY-MM-DD)
+    try:
+        datetime.date.fromisoformat(date)
+    except (TypeError, ValueError):
+        print(f'Invalid date string {date}')
+        return False
+    # Values must be iterable
+    try:
+        iterator = iter(ranking)
+    except TypeError:
+        print(f'Value {ranking} is not iterable')
+        return False
+    # Each item must be a dict with the required keys
+    required_keys = {'title', 'artist', 'query', 'uri'}
+    for item in ranking:
+        if not (isinstance(item, (dict, ChartEntry)) and
+                all(key in item for key in required_keys)
+        ):
+            print(f'Item {item} is not a dict or does not have all required keys')
+            return False
+
+    # Passed all checks; valid week
+    return True
+
+
 def valid_spotify_info(spotify_info_dict: dict) -> bool:
     """Checks if given spotify_info_dict.  In this case, valid means
            keys must be valid Spotify track URIs
@@ -816,99 +3677,378 @@ def valid_spotify_info(spotify_info_dict: dict) -> bool:
     # Passed all checks; valid spotify info
     return True
 
-def update_mongo():
+def get_mongo_client(connect_string: str = None) -> MongoClient:
+    """Returns a MongoClient shared by the whole process, creating it on
+       first use.  MongoClient pools its connections, so reusing one
+       client avoids a new handshake with Atlas for every write.
+
+    Args:
+        connect_string (str): The MongoDB connection string.  Defaults to
+            None, which uses the environment variable ATLAS_CONNECT.
+
+    Returns:
+        MongoClient: The shared client.
+    """
+    global _mongo_client
+    if _mongo_client is None:
+        _mongo_client = MongoClient(connect_string or os.environ['ATLAS_CONNECT'])
+    return _mongo_client
+
+
+def bulk_upsert(collection,
+                documents: list,
+                batch_size: int = 1000,
+                overwrite: bool = True) -> dict:
+    """Upserts documents into collection with unordered bulk writes.
+
+    Args:
+        collection (pymongo.collection.Collection): The collection to
+            write to.
+        documents (list): A list of dicts, each with a unique '_id' field
+            (Ex. the output of get_mongo_dataset or
+            get_mongo_spotify_info).
+        batch_size (int): The number of documents sent in each bulk
+            write. Defaults to 1000.
+        overwrite (bool): If True, existing documents are replaced.  If
+            False, existing documents are left untouched and counted as
+            skipped. Defaults to True.
+
+    Returns:
+        dict: Counts of the form: {'inserted': inserted,
+                                   'updated': updated,
+                                   'skipped': skipped} .
+
+    Raises:
+        InvalidInputException: If batch_size is not positive.
+    """
+    if batch_size < 1:
+        print('Batch size must be positive')
+        raise InvalidInputException
+
+    counts = {'inserted': 0, 'updated': 0, 'skipped': 0}
+    for batch in _chunks(list(documents), batch_size):
+        if overwrite:
+            requests_ = [ReplaceOne({'_id': doc['_id']}, doc, upsert=True) for doc in batch]
+        else:
+            requests_ = [UpdateOne({'_id': doc['_id']}, {'$setOnInsert': doc}, upsert=True)
+                         for doc in batch]
+        with METRICS.timer('mongo_bulk_write_seconds', collection=collection.name):
+            result = collection.bulk_write(requests_, ordered=False)
+        counts['inserted'] += result.upserted_count
+        counts['updated'] += result.modified_count
+        counts['skipped'] += result.matched_count - result.modified_count
+
+    for outcome, count in counts.items():
+        METRICS.increment('mongo_documents_total', count, collection=collection.name, outcome=outcome)
+
+    return counts
+
+
+def set_stored_uris(collection,
+                    uri_dict: dict,
+                    batch_size: int = 1000) -> int:
+    """Sets the uri of every stored ranking item whose query is in
+       uri_dict, so uris found after a week was uploaded (by a retried
+       miss or a manual fix) reach the weeks already in collection.
+
+    Args:
+        collection (pymongo.collection.Collection): A collection of
+            documents with the form returned by get_mongo_dataset
+            (without spotify_info_dict).
+        uri_dict (dict): Keys are Spotify query strings and values are
+            uris.  Queries with a None uri are skipped.
+        batch_size (int): The number of queries looked up, and of
+            updates sent, at once. Defaults to 1000.
+
+    Returns:
+        int: The number of documents modified.
+
+    Raises:
+        InvalidInputException: If batch_size is not positive.
+    """
+    if batch_size < 1:
+        print('Batch size must be positive')
+        raise InvalidInputException
+
+    # Read the matching weeks once, then set each matching item by index;
+    # the filter skips weeks whose item changed in between
+    updates = {query: uri for query, uri in uri_dict.items() if uri is not None}
+    requests_ = []
+    for batch in _chunks(list(updates), batch_size):
+        for document in collection.find({'ranking.query': {'$in': batch}}, {'ranking.query': 1}):
+            matches = [(i, item['query']) for i, item in enumerate(document['ranking'])
+                       if item.get('query') in updates]
+            requests_.append(UpdateOne({'_id': document['_id'],
+                                        **{f'ranking.{i}.query': query for i, query in matches}},
+                                       {'$set': {f'ranking.{i}.uri': updates[query] for i, query in matches}}))
+
+    modified = 0
+    for batch in _chunks(requests_, batch_size):
+        with METRICS.timer('mongo_bulk_write_seconds', collection=collection.name):
+            result = collection.bulk_write(batch, ordered=False)
+        modified += result.modified_count
+    METRICS.increment('mongo_documents_total', modified, collection=collection.name, outcome='uri_fixed')
+    return modified
+
+
+def find_missing_weeks(collection,
+                       end_date: datetime.date = None,
+                       start_date: datetime.date = None,
+                       day_of_the_week: int = 2) -> tuple:
+    """Finds the chart weeks missing from a collection of weekly charts,
+       both after its latest week and in gaps between stored weeks.
+       Only the '_id' field of each document is read.
+
+    Args:
+        collection (pymongo.collection.Collection): A collection of
+            documents with the form returned by get_mongo_dataset.
+        end_date (datetime.date): Indicates the last week that should be
+            stored (inclusive). Defaults to None, which uses today.
+        start_date (datetime.date): Indicates the first week that should
+            be stored (inclusive). Defaults to None, which uses the
+            earliest stored week, or end_date if nothing is stored.
+        day_of_the_week (int): Indicates the Python day of the week
+            (Ex. 0 is Monday, 1 is Tuesday, ..., 6 is Sunday). Defaults
+            to 2 (Wednesday).
+
+    Returns:
+        tuple: A 2-arg tuple where the first arg is a list of the
+            ISO-formatted (YYYY-MM-DD) dates of the missing weeks, in
+            order, and the second arg is the date of the latest stored
+            week (None if nothing is stored).
+    """
+    stored = sorted(document['_id'] for document in collection.find({}, {'_id': 1}))
+    end_date = end_date or datetime.date.today()
+    if start_date is None:
+        start_date = stored[0] if stored else end_date
+    expected = _get_week_dates(start_date,
+                               end_date,
+                               {},
+                               refresh=False,
+                               day_of_the_week=day_of_the_week)
+    stored_dates = set(stored)
+    missing_dates = [date for date in expected if date not in stored_dates]
+    return missing_dates, stored[-1] if stored else None
+
+
+def build_missing_weeks(collection,
+                        missing_dates: list,
+                        spotify_client: spotipy.Spotify,
+                        http_session: requests.Session,
+                        debug: bool = False,
+                        record_misses_list: list = None,
+                        top_k: int = 50,
+                        day_of_the_week: int = 2,
+                        query_cache: QueryCache = None) -> dict:
+    """Builds only the given weeks, one contiguous run at a time.  The
+       stored week before each run seeds query_cache, so songs still on
+       the chart aren't searched again.
+
+    Args:
+        collection (pymongo.collection.Collection): The collection of
+            weekly charts the weeks are missing from.
+        missing_dates (list): ISO-formatted (YYYY-MM-DD) dates of the
+            weeks to build, in order (Ex. from find_missing_weeks).
+        spotify_client (spotipy.Spotify): A Spotify client session used for
+            accessing Spotify's Web API.
+        http_session (requests.Session): The HTTP session used to send GET
+            requests to Billboard.
+        debug (bool): If True, prints missed queries and finished dates.
+            Defaults to False.
+        record_misses_list (list): A list (or MissStore) where the query
+            misses are recorded. Defaults to None.
+        top_k (int): Each week in the dataset will have the top_k of the
+            Billboard Hot 100. Defaults to 50.
+        day_of_the_week (int): Indicates the Python day of the week
+            (Ex. 0 is Monday, 1 is Tuesday, ..., 6 is Sunday). Defaults
+            to 2 (Wednesday).
+        query_cache (QueryCache): A cache of query/uri pairs. Defaults to
+            None, which uses an in-memory cache.
+
+    Returns:
+        dict: The same dict returned by build_dataset, holding only the
+            missing weeks.
+    """
+    query_cache = query_cache if query_cache is not None else QueryCache()
+    week = datetime.timedelta(weeks=1)
+
+    # Split the weeks into runs of consecutive weeks
+    runs = []
+    for date in missing_dates:
+        if runs and datetime.date.fromisoformat(runs[-1][-1]) + week == datetime.date.fromisoformat(date):
+            runs[-1].append(date)
+        else:
+            runs.append([date])
+
+    dataset = ValidatedDataset()
+    for run in runs:
+        # Seed the cache with the stored week before the run; denormalized
+        # documents have no queries and are skipped
+        prev_week = str(datetime.date.fromisoformat(run[0]) - week)
+        document = collection.find_one({'_id': prev_week})
+        if document is not None:
+            query_cache.update_from_dataset({prev_week: [item for item in document['ranking']
+                                                         if 'query' in item and 'uri' in item]})
+        build_dataset(start_date=run[0],
+                      end_date=run[-1],
+                      spotify_client=spotify_client,
+                      http_session=http_session,
+                      historical_data=dataset,
+                      refresh=False,
+                      debug=debug,
+                      record_misses_list=record_misses_list,
+                      top_k=top_k,
+                      day_of_the_week=day_of_the_week,
+                      query_cache=query_cache)
+
+    return dataset
+
+
+def update_mongo(batch_size: int = 1000, start_date: datetime.date = None) -> dict:
     """Updates MongoDB Atlas Cluster with the latest Billboard info.
+       Every week missing from billboard_rankings, since its latest week
+       or in gaps between stored weeks, is built and written in one
+       batch, so a missed run is caught up by the next one.  Uris
+       found for past misses, by retrying them or as manual overrides,
+       are also set on the weeks already stored.
        Assumes the MongoDB database is named 'data', and there are
        *two* collections in 'data' called 'billboard_rankings' and
        'spotify_info'.  Further assumes that the MongoDB Atlas
        connection string is stored as environment variable
        ATLAS_CONNECT
 
+    Args:
+        batch_size (int): The number of documents sent in each bulk
+            write. Defaults to 1000.
+        start_date (datetime.date): Indicates the first week that should
+            be stored. Defaults to None, which uses the earliest stored
+            week (or only this week if nothing is stored).
+
+    Returns:
+        dict: The bulk_upsert counts for each collection, of the form:
+            {'spotify_info': counts, 'billboard_rankings': counts} .
+
     Raises:
         pymongo.errors.InvalidName: If a db or collection name is
             not found.
-        pymongo.errors.DuplicateKeyError: If the function tries to
-            add a document with a duplicate '_id' field to a
-            collection.
+        pymongo.errors.BulkWriteError: If a bulk write fails.
         pymongo.errors.ConnectionFailure: If a connection can't be
             established with MongoDB Atlas (typically due to an
             invalid connection string).
     """
-    # Get latest week's Top 50
-    misses = []
-    new_data = build_dataset(historical_data=None,
-                             start_date=datetime.date.today(),
-                             end_date=datetime.date.today(),
-                             spotify_client=spotify,
-                             http_session=http,
-                             refresh=False,
-                             debug=True,
-                             record_misses_list=misses,
-                             top_k=50,
-                             day_of_the_week=2)
-
-    most_recent_date = list(new_data)[-1]
+    # Open the local state, importing the old pickle/JSON files the first time
+    json_directory = os.path.join(os.getcwd(), '..', 'json-files')
+    state_path = os.path.join(json_directory, 'state.sqlite3')
+    is_new_state = not os.path.exists(state_path)
+    state = StateStore(state_path)
+    if is_new_state:
+        print(f'Imported into {state_path}: {state.import_files(json_directory)}')
+    misses = state.miss_store()
+    db = get_mongo_client().data
+
+    # manual_uris_dict.json is read every run, so edits to it take effect
+    manual_path = os.path.join(json_directory, 'manual_uris_dict.json')
+    if os.path.exists(manual_path):
+        with open(manual_path, 'r', encoding='utf-8') as f:
+            state.set_manual_uris(json.load(f))
+    manual_uris = state.get_manual_uris()
+
+    # New and changed manual uris win over searches in the new weeks (via
+    # the cache) and are set on the weeks already stored; each override
+    # is only sent to MongoDB once.  They resolve their misses for good
+    # (even if None)
+    query_cache = state.query_cache(negative_ttl=datetime.timedelta(weeks=4))
+    unapplied_uris = state.get_unapplied_manual_uris()
+    fixed_uris = {query: uri for query, uri in unapplied_uris.items() if uri is not None}
+    for query, uri in fixed_uris.items():
+        query_cache[query] = uri
+    fixed_count = set_stored_uris(db.billboard_rankings, fixed_uris, batch_size=batch_size)
+    for query, uri in manual_uris.items():
+        misses.resolve(query, uri)
+
+    # Retry the misses that are due and apply found uris the same way;
+    # retry caches them for the new weeks
+    found = misses.retry(spotify, query_cache, resolve=False)
+    fixed_count += set_stored_uris(db.billboard_rankings, found, batch_size=batch_size)
+    for query, uri in found.items():
+        misses.resolve(query, uri)
+    fixed_uris.update(found)
+    print(f'Resolved {len(found)} past misses ({fixed_count} stored rankings updated), {len(misses)} remain')
+
+    # Get the Top 50 of every week not stored yet
+    missing_dates, latest_date = find_missing_weeks(db.billboard_rankings,
+                                                    start_date=start_date,
+                                                    day_of_the_week=2)
+    if not missing_dates and not state.get_new_uris(set(fixed_uris.values())):
+        print(f'billboard_rankings is up to date (latest week {latest_date})')
+        state.mark_manual_uris_applied(unapplied_uris)
+        state.close()
+        return {'spotify_info': {'inserted': 0, 'updated': 0, 'skipped': 0},
+                'billboard_rankings': {'inserted': 0, 'updated': 0, 'skipped': 0}}
+    if missing_dates:
+        print(f'Building {len(missing_dates)} missing weeks since {latest_date}')
+    new_data = build_missing_weeks(db.billboard_rankings,
+                                   missing_dates,
+                                   spotify_client=spotify,
+                                   http_session=http,
+                                   debug=True,
+                                   record_misses_list=misses,
+                                   top_k=50,
+                                   day_of_the_week=2,
+                                   query_cache=query_cache)
 
     # Prep result for mongodb upload
-    mongo_new_data = {'_id': most_recent_date,
-                      'ranking': new_data[most_recent_date]}
+    mongo_new_data = get_mongo_dataset(new_data)
 
-    new_uris = get_unique_uris(new_data)
+    # The fixed uris need their track info too
+    new_uris = get_unique_uris(new_data) | set(fixed_uris.values())
 
     # Determine which uris are new
-    with open(os.path.join(os.getcwd(), '..', 'json-files', 'unique_uris.pickle'), 'rb') as f:
-        uris = pickle.load(f)
-    input_uris = new_uris - uris
-    uris = uris | input_uris
+    input_uris = state.get_new_uris(new_uris)
 
     # Get info for those new uris and prep for mongodb upload
+    missing_uris = []
     new_spotify_info = get_spotify_info(input_uris,
                                         artist_info=True,
-                                        audio_features=True)
+                                        audio_features=True,
+                                        missing_uris=missing_uris)
+    if missing_uris:
+        print(f'Spotify has no track for {len(missing_uris)} uris: {missing_uris}')
 
     mongo_new_spotify_info = get_mongo_spotify_info(new_spotify_info)
 
-    # Upload results to mongodb
-    client = MongoClient(os.environ['ATLAS_CONNECT'])
-    db = client.data
-    spotify_info = db.spotify_info
-    billboard_rankings = db.billboard_rankings
-    if len(mongo_new_spotify_info) > 0:
-        for item in mongo_new_spotify_info:
-            try:
-                spotify_info.insert_one(item)
-            except DuplicateKeyError as e:
-                pass
-    billboard_rankings.insert_one(mongo_new_data)
-
-    # Update and save query misses
-    if len(misses) > 0:
-        with open(os.path.join(os.getcwd(), '..', 'json-files', 'query_misses.pickle'), 'rb') as f:
-            query_misses = pickle.load(f)
-        query_misses += misses[0]
-        with open(os.path.join(os.getcwd(), '..', 'json-files', 'query_misses.pickle'), 'wb') as f:
-            pickle.dump(query_misses, f)
-        
-    with open(os.path.join(os.getcwd(), '..', 'json-files', 'unique_uris.pickle'), 'wb') as f:
-        pickle.dump(uris, f)
+    # Upload results to mongodb; existing track info is kept as is
+    counts = {'spotify_info': bulk_upsert(db.spotify_info,
+                                          mongo_new_spotify_info,
+                                          batch_size=batch_size,
+                                          overwrite=False),
+              'billboard_rankings': bulk_upsert(db.billboard_rankings,
+                                                mongo_new_data,
+                                                batch_size=batch_size)}
+    print(f'Mongo writes: {counts}')
+
+    # Only mark uris as known (and overrides as applied) once their info is uploaded;
+    # missing uris are asked for again the next time they chart
+    state.add_uris(input_uris - set(missing_uris))
+    state.mark_manual_uris_applied(unapplied_uris)
+    state.close()
+
+    return counts
 
 
 class InvalidInputException(Exception):
     pass
 
 if __name__ == '__main__':
-    spotify = spotipy.Spotify(client_credentials_manager=SpotifyClientCredentials())
-
-    retry_strategy = Retry(
-        total=5,
-        status_forcelist=[429, 500, 502, 503, 504],
-        method_whitelist=["HEAD", "GET", "OPTIONS"],
-        backoff_factor=2
-    )
+    # Billboard and Spotify requests share one scheduler, which handles 429s
+    scheduler = RequestScheduler(rates=DEFAULT_RATES)
+    spotify = create_spotify_client(scheduler=scheduler)
 
-    http = create_http_session(retry_strategy=retry_strategy)
+    http = create_http_session(retry_strategy=RETRY_STRATEGY, scheduler=scheduler)
 
     update_mongo()
+    with open(os.path.join(os.getcwd(), '..', 'json-files', 'update_mongo_metrics.prom'), 'w') as f:
+        f.write(METRICS.to_prometheus())
     # start_date = datetime.date.fromisoformat('1980-01-02')
     # end_date = datetime.date.today()
     # misses = []
@@ -0,0 +1,299 @@
+# Python standard library imports
+import datetime
+import hashlib
+import json
+import os
+
+# Third-party imports
+import mongomock
+import pytest
+
+# Local imports
+import scraper
+from benchmark import synthetic_chart_page
+from columnar import load_dataset_columnar, save_dataset_columnar
+
+
+ITEM = {'title': 'Rock With You',
+        'artist': 'Michael Jackson',
+        'query': 'track:Rock With You artist:Michael Jackson',
+        'uri': 'spotify:track:0SErdEdRcVX1uJCf1eTGYH'}
+
+
+class FakeResponse:
+    def __init__(self, content: bytes, status_code: int = 200):
+        self.content = content
+        self.status_code = status_code
+        self.headers = {}
+
+
+class FakeBillboardSession:
+    """Serves synthetic chart pages and counts the requests."""
+    def __init__(self):
+        self.requests = 0
+
+    def get(self, url, **kwargs):
+        self.requests += 1
+        return FakeResponse(synthetic_chart_page(url.rstrip('/').rsplit('/', 1)[-1]))
+
+
+def _fake_uri(query: str) -> str:
+    return 'spotify:track:' + hashlib.md5(query.encode('utf-8')).hexdigest()[:22]
+
+
+class FakeSpotify:
+    """Finds a track for every query except those starting with one of
+       misses, and counts the searches."""
+    def __init__(self, misses: tuple = ()):
+        self.misses = misses
+        self.searches = 0
+
+    def search(self, q, type='track', **kwargs):
+        self.searches += 1
+        if q.startswith(self.misses):
+            return {'tracks': {'items': []}}
+        return {'tracks': {'items': [{'uri': _fake_uri(q)}]}}
+
+    def tracks(self, ids):
+        return {'tracks': [{'uri': f'spotify:track:{track_id}',
+                            'name': track_id,
+                            'artists': [{'uri': 'spotify:artist:a', 'name': 'A'}],
+                            'album': {'images': []}}
+                           for track_id in ids]}
+
+    def audio_features(self, ids):
+        return [{'uri': f'spotify:track:{track_id}', 'energy': 0.5} for track_id in ids]
+
+    def artists(self, ids):
+        return {'artists': [{'uri': f'spotify:artist:{artist_id}', 'genres': ['pop']}
+                            for artist_id in ids]}
+
+
+@pytest.fixture
+def mongo_client(monkeypatch):
+    client = mongomock.MongoClient()
+    monkeypatch.setattr(scraper, 'get_mongo_client', lambda *args, **kwargs: client)
+    return client
+
+
+@pytest.fixture
+def json_directory(tmp_path, monkeypatch, mongo_client):
+    """Runs update_mongo from a scraper directory next to an empty
+       json-files directory, with fake Billboard and Spotify clients."""
+    os.makedirs(os.path.join(str(tmp_path), 'json-files'))
+    os.makedirs(os.path.join(str(tmp_path), 'scraper'))
+    monkeypatch.chdir(os.path.join(str(tmp_path), 'scraper'))
+    monkeypatch.setattr(scraper, 'spotify', FakeSpotify(), raising=False)
+    monkeypatch.setattr(scraper, 'http', FakeBillboardSession(), raising=False)
+    return os.path.join(str(tmp_path), 'json-files')
+
+
+def _dataset():
+    """Returns a small dataset whose first week is empty, as a failed
+       page fetch leaves it."""
+    return {'2020-01-01': [],
+            '2020-01-08': [dict(ITEM), dict(ITEM, uri=None)],
+            '2020-01-15': [dict(ITEM)]}
+
+
+@pytest.mark.parametrize('kwargs', [{},
+                                    {'indent': 4},
+                                    {'mongodb': True},
+                                    {'ndjson': True},
+                                    {'compression': 'gzip'},
+                                    {'compression': 'gzip', 'indent': 2}])
+def test_load_dataset_json_round_trip(tmp_path, kwargs):
+    file_path = scraper.save_dataset_as_json(_dataset(), str(tmp_path), **kwargs)
+    assert dict(scraper.load_dataset_json(file_path)) == _dataset()
+
+
+@pytest.mark.parametrize('indent', [None, 2, 4])
+def test_load_dataset_json_without_name_suffix(tmp_path, indent):
+    # Pretty-printed files under a plain name (Ex. renamed or hand-edited)
+    file_path = os.path.join(str(tmp_path), 'dataset.json')
+    with open(file_path, 'w', encoding='utf-8') as f:
+        json.dump(_dataset(), f, indent=indent)
+    assert dict(scraper.load_dataset_json(file_path)) == _dataset()
+
+
+def test_load_dataset_json_indented_stream_renamed(tmp_path):
+    # The stream writer's indented layout starts with a complete record
+    file_path = scraper.save_dataset_as_json(_dataset(), str(tmp_path), indent=4)
+    renamed_path = os.path.join(str(tmp_path), 'dataset.json')
+    os.rename(file_path, renamed_path)
+    assert dict(scraper.load_dataset_json(renamed_path)) == _dataset()
+
+
+def test_load_dataset_json_indented_mongodb_list(tmp_path):
+    file_path = os.path.join(str(tmp_path), 'dataset.json')
+    with open(file_path, 'w', encoding='utf-8') as f:
+        json.dump([{'_id': date, 'ranking': ranking} for date, ranking in _dataset().items()], f, indent=4)
+    assert dict(scraper.load_dataset_json(file_path)) == _dataset()
+
+
+def test_set_stored_uris(mongo_client):
+    collection = mongo_client.data.billboard_rankings
+    collection.insert_many([{'_id': '2020-01-01', 'ranking': [dict(ITEM, uri=None), dict(ITEM, uri=None)]},
+                            {'_id': '2020-01-08', 'ranking': [dict(ITEM, query='other'), dict(ITEM, uri=None)]},
+                            {'_id': '2020-01-15', 'ranking': [dict(ITEM, query='other', uri=None)]}])
+    assert scraper.set_stored_uris(collection, {ITEM['query']: ITEM['uri'], 'other': None}, batch_size=1) == 2
+    assert [item['uri'] for item in collection.find_one({'_id': '2020-01-01'})['ranking']] == [ITEM['uri']] * 2
+    assert [item['uri'] for item in collection.find_one({'_id': '2020-01-08'})['ranking']] == [ITEM['uri']] * 2
+    assert collection.find_one({'_id': '2020-01-15'})['ranking'][0]['uri'] is None
+    assert scraper.set_stored_uris(collection, {ITEM['query']: ITEM['uri']}) == 0
+
+
+def test_update_mongo_applies_found_and_manual_uris(json_directory, mongo_client, monkeypatch):
+    rankings = mongo_client.data.billboard_rankings
+    start_date = datetime.date.today() - datetime.timedelta(weeks=3)
+    first_week = scraper._get_week_dates(start_date, start_date, {}, refresh=False)[0]
+    missed = dict(ITEM, title='A', artist='X', query='track:A artist:X', uri=None)
+    manual = dict(ITEM, title='B', artist='Y', query='track:B artist:Y', uri=None)
+    rankings.insert_one({'_id': first_week, 'ranking': [missed, manual]})
+    state = scraper.StateStore(os.path.join(json_directory, 'state.sqlite3'))
+    misses = state.miss_store()
+    misses.record(missed['query'], 0, first_week)
+    misses.record(manual['query'], 1, first_week)
+    state.close()
+    with open(os.path.join(json_directory, 'manual_uris_dict.json'), 'w', encoding='utf-8') as f:
+        json.dump({manual['query']: 'spotify:track:manualB'}, f)
+
+    # Make the stored misses due
+    due = scraper.MissStore.due
+    monkeypatch.setattr(scraper.SQLiteMissStore, 'due',
+                        lambda self, now=None: (self._load(),
+                                                due(self, datetime.datetime.now() + datetime.timedelta(weeks=2)))[1])
+    counts = scraper.update_mongo(batch_size=10)
+
+    assert counts['billboard_rankings']['inserted'] == 3
+    ranking = rankings.find_one({'_id': first_week})['ranking']
+    assert ranking[0]['uri'] == _fake_uri('track:A artist:X')
+    assert ranking[1]['uri'] == 'spotify:track:manualB'
+    assert mongo_client.data.spotify_info.find_one({'_id': 'spotify:track:manualB'}) is not None
+    state = scraper.StateStore(os.path.join(json_directory, 'state.sqlite3'))
+    assert len(state.miss_store()) == 0
+    state.close()
+
+
+def test_update_mongo_sends_each_manual_uri_once(json_directory, mongo_client, monkeypatch):
+    manual_path = os.path.join(json_directory, 'manual_uris_dict.json')
+    with open(manual_path, 'w', encoding='utf-8') as f:
+        json.dump({'track:B artist:Y': 'spotify:track:manualB', 'track:C artist:Z': None}, f)
+    sent = []
+    set_stored_uris = scraper.set_stored_uris
+    monkeypatch.setattr(scraper, 'set_stored_uris',
+                        lambda collection, uri_dict, **kwargs: (sent.append(dict(uri_dict)),
+                                                                set_stored_uris(collection, uri_dict, **kwargs))[1])
+    scraper.update_mongo(batch_size=10)
+    scraper.update_mongo(batch_size=10)
+    with open(manual_path, 'w', encoding='utf-8') as f:
+        json.dump({'track:B artist:Y': 'spotify:track:newB', 'track:C artist:Z': None}, f)
+    scraper.update_mongo(batch_size=10)
+
+    manual_sends = [uri_dict for uri_dict in sent if uri_dict]
+    assert manual_sends == [{'track:B artist:Y': 'spotify:track:manualB'},
+                            {'track:B artist:Y': 'spotify:track:newB'}]
+
+
+def test_track_match_index_propose_legacy_miss_list():
+    # query_misses.pickle ends with a tuple flattened into loose elements
+    index = scraper.TrackMatchIndex()
+    index.add('spotify:track:a', 'A', ['X'])
+    index.add('spotify:track:b', 'B', ['Y'])
+    misses = [(0, datetime.date(2020, 1, 1), 'track:A artist:X'),
+              5, datetime.date(2020, 1, 8), 'track:B artist:Y']
+    proposals = index.propose(misses)
+    assert set(proposals) == {'track:A artist:X', 'track:B artist:Y'}
+    assert proposals['track:B artist:Y'][0][0] == 'spotify:track:b'
+
+
+def _searches() -> int:
+    return sum(timer['count'] for timer in scraper.METRICS.to_dict()['timers']
+               if timer['name'] == 'spotify_search_seconds')
+
+
+def test_build_dataset_sharded_searches_like_serial():
+    start_date, end_date = datetime.date(2020, 1, 1), datetime.date(2020, 12, 30)
+    scraper.METRICS.reset()
+    serial = scraper.build_dataset(start_date, end_date, FakeSpotify(), FakeBillboardSession(),
+                                   query_cache=scraper.QueryCache())
+    serial_searches = _searches()
+    scraper.METRICS.reset()
+    sharded = scraper.build_dataset_sharded(start_date, end_date, shards=4, processes=2,
+                                            http_session_factory=FakeBillboardSession,
+                                            spotify_client_factory=FakeSpotify)
+    assert dict(sharded) == dict(serial)
+    assert _searches() == serial_searches
+
+
+def test_get_spotify_info_skips_unknown_tracks(monkeypatch):
+    class UnknownTrackSpotify(FakeSpotify):
+        def tracks(self, ids):
+            found = super().tracks(ids)
+            return {'tracks': [None if track['name'].endswith('unknown') else track for track in found['tracks']]}
+
+    missing_uris = []
+    spotify_info = scraper.get_spotify_info({'spotify:track:known', 'spotify:track:unknown'},
+                                            artist_info=True,
+                                            audio_features=True,
+                                            spotify_client=UnknownTrackSpotify(),
+                                            missing_uris=missing_uris)
+    assert list(spotify_info) == ['spotify:track:known']
+    assert spotify_info['spotify:track:known']['artist_info']['genres'] == ['pop']
+    assert missing_uris == ['spotify:track:unknown']
+
+
+class RenamedRowSession(FakeBillboardSession):
+    """Serves synthetic chart pages whose rows have another class."""
+    def get(self, url, **kwargs):
+        page = super().get(url, **kwargs)
+        return FakeResponse(page.content.replace(b'chart-list__element ', b'o-chart-row '))
+
+
+def test_build_dataset_with_extractor():
+    start_date, end_date = datetime.date(2020, 1, 1), datetime.date(2020, 3, 25)
+    expected = scraper.build_dataset(start_date, end_date, FakeSpotify(), FakeBillboardSession())
+    extractor = scraper.ChartPageExtractor(dict(scraper.CHART_SELECTORS[scraper.LATEST_CHART_SELECTORS],
+                                                row_class='o-chart-row'))
+    assert dict(scraper.build_dataset(start_date, end_date, FakeSpotify(), RenamedRowSession(),
+                                      extractor=extractor)) == dict(expected)
+    assert dict(scraper.build_dataset_sharded(start_date, end_date, shards=2, processes=2,
+                                              http_session_factory=RenamedRowSession,
+                                              spotify_client_factory=FakeSpotify,
+                                              extractor=extractor)) == dict(expected)
+
+
+class PlaceholderSession(FakeBillboardSession):
+    """Serves a page without chart rows for 2020-01-15."""
+    def get(self, url, **kwargs):
+        if url.endswith('2020-01-15'):
+            self.requests += 1
+            return FakeResponse(b'<html><body>Please try again later</body></html>')
+        return super().get(url, **kwargs)
+
+
+def test_build_dataset_sharded_page_cache(tmp_path):
+    page_cache = scraper.ChartPageCache(str(tmp_path))
+    dataset = scraper.build_dataset_sharded(datetime.date(2020, 1, 1), datetime.date(2020, 2, 26),
+                                            shards=2, processes=2,
+                                            http_session_factory=PlaceholderSession,
+                                            spotify_client_factory=FakeSpotify,
+                                            page_cache=page_cache)
+    assert dataset['2020-01-15'] == []
+    assert page_cache.dates() == [date for date in sorted(dataset) if date != '2020-01-15']
+
+
+def test_columnar_dataset_is_valid(tmp_path):
+    save_dataset_columnar(_dataset(), str(tmp_path / 'columnar'))
+    dataset = load_dataset_columnar(str(tmp_path / 'columnar'))
+    assert scraper.valid_dataset(dataset)
+    file_path = scraper.save_dataset_as_json(dataset, str(tmp_path))
+    assert dict(scraper.load_dataset_json(file_path)) == _dataset()
+    assert list(scraper.get_mongo_dataset(dataset)) == list(scraper.get_mongo_dataset(_dataset()))
+    # Builds add weeks to historical_data, so they need a mutable copy
+    with pytest.raises(scraper.InvalidInputException):
+        scraper.build_dataset(datetime.date(2020, 1, 22), datetime.date(2020, 1, 22),
+                              FakeSpotify(), FakeBillboardSession(), historical_data=dataset)
+    built = scraper.build_dataset(datetime.date(2020, 1, 22), datetime.date(2020, 1, 22),
+                                  FakeSpotify(), FakeBillboardSession(), historical_data=dataset.to_dict())
+    assert len(built) == 4